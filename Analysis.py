@@ -0,0 +1,351 @@
+## The Analysis module does the calculations behind the functions in Plotting.py without drawing anything.
+## Each plotting function has a function here that returns its results, and the plotting function just draws them:
+##   cut2D()      -> cut2DData()
+##   cut1D()      -> cut1DData()
+##   resolution() -> resolutionData()
+##   cut2DError() -> cut2DErrorData()
+## The results are dicts with the histograms, fit parameters, FWHMs and the points where the fits failed,
+## and they can be drawn later with plotCut2D(), plotCut1D(), plotResolution() and plotCut2DError() in Plotting.py.
+## Nothing here prints results or opens a figure, and matplotlib.pyplot is never imported, so this module
+## can be used for long unattended jobs (e.g. on a cluster) where only the numbers are needed.
+## Like the plotting functions, every function that takes the dataframe also accepts an EventTable,
+## an EventIndex or a DataCube, except resolutionMoments() (and resolutionData(method = "moments")), which needs
+## the events and raises a TypeError for a DataCube.
+
+##Here are the necessary import statements for this file
+import numpy as np
+import pandas as pd
+import scipy
+import os
+import shutil
+import tempfile
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from lmfit.models import GaussianModel
+from EventIndex import EventIndex
+from DataCube import DataCube
+from EventStore import saveEvents, loadEvents
+from Profiling import stage, profilingEnabled, profiledCall, collectProfiles
+
+## _integrationVolume() returns the events of dataframe inside the integration volumes in windows, which is a list of
+## (integrationVar, (integrationVal, integrationWidth)) pairs, keeping integrationVal - integrationWidth < integrationVar
+## < integrationVal + integrationWidth. It uses the index if dataframe is an EventIndex, and cuts the cube if it is a DataCube.
+def _integrationVolume(dataframe, windows):
+    if isinstance(dataframe, EventIndex):
+        return dataframe.query(windows)
+    if isinstance(dataframe, DataCube):
+        return dataframe.cut(windows)
+    data = dataframe
+    for integrationVar, (integrationVal, integrationWidth) in windows:
+        data = data[data[integrationVar] > integrationVal-integrationWidth]
+        data = data[data[integrationVar] < integrationVal + integrationWidth]
+    return data
+
+## _variableRange() gives the smallest and largest value of variable
+def _variableRange(dataframe, variable):
+    if isinstance(dataframe, DataCube):
+        binEdges = dataframe.edges[dataframe.variables.index(variable)]
+        return binEdges[0], binEdges[-1]
+    return dataframe[variable].min(), dataframe[variable].max()
+
+## _checkVariables() makes sure every variable is in the dataframe
+def _checkVariables(dataframe, variables):
+    for variable in variables:
+        if variable not in dataframe.columns:
+            print(f"{variable} was not recognized as a variable within the dataframe!")
+            return False
+    return True
+
+## cut2DData() selects the events of cut2D() in Plotting.py: the events with integrationVar inside
+## integrationVal +- integrationWidth. The result is {"data": the events (or the 2D cube for a DataCube),
+## "integrationVar": ..., "integrationVal": ..., "integrationWidth": ...}, or None if integrationVar is wrong.
+def cut2DData(dataframe, integrationVar, integrationVal, integrationWidth):
+    if _checkVariables(dataframe, [integrationVar]) == False:
+        return None
+    data = _integrationVolume(dataframe, [(integrationVar, (integrationVal, integrationWidth))])
+    return {"data": data, "integrationVar": integrationVar, "integrationVal": integrationVal,
+            "integrationWidth": integrationWidth}
+
+## cut1DData() histograms and fits the events of cut1D() in Plotting.py (see there for the arguments).
+## The result has the histogram ("binCenters" and "histogram"), the fit ("bestValues", the dict cut1D() returns,
+## and "bestFit", the fitted curve at binCenters), the range of the histogram ("minVal" and "maxVal"), the arguments,
+## and "failed", which is True if the fit failed (bestValues and bestFit are then None).
+## It returns None if one of the variables is wrong.
+def cut1DData(dataframe, xVar, binSize, integrationVar1, integrationVal1, integrationWidth1, integrationVar2,
+              integrationVal2, integrationWidth2, threshold = None, binRange = None):
+    ## The variable names are checked first in case integrationVar1 or integrationVar2 are incorrectly named.
+    if _checkVariables(dataframe, [integrationVar1, integrationVar2]) == False:
+        return None
+    ## Here we extract the integration region that's valid.
+    data = _integrationVolume(dataframe, [(integrationVar1, (integrationVal1, integrationWidth1)),
+                                          (integrationVar2, (integrationVal2, integrationWidth2))])
+    ## Here we control the minimum regions to be plotted based off the binRange
+    ## This is needed for the gaussian fit
+    if isinstance(data, DataCube):
+        ## A DataCube is already histogrammed, so its bins are joined to come as close to binSize as they can
+        if data.variables != [xVar]:
+            print(f"{xVar} was not recognized as a variable within the dataframe!")
+            return None
+        cubeBinSize = data.edges[0][1] - data.edges[0][0]
+        data = data.rebin(xVar, max(1, int(round(binSize/cubeBinSize))))
+        ## Each bin is placed at its upper edge, the same as the bins of the events below
+        ## (binEdges[:-1] + the bin width), so a cube and its events give the same binCenters
+        histData, binCenters = data.hist, data.edges[0][1:]
+        if binRange != None:
+            inRange = (binCenters > binRange[0]) & (binCenters < binRange[1])
+            histData, binCenters = histData[inRange], binCenters[inRange]
+        if len(binCenters) == 0:
+            minVal, maxVal = binRange[0], binRange[1]
+        else:
+            minVal, maxVal = binCenters[0], binCenters[-1]
+    else:
+        if binRange == None:
+            minVal, maxVal = data[xVar].min(), data[xVar].max()
+
+        else:
+            minVal, maxVal = binRange[0], binRange[1]
+        ## Now the data is histogrammed based off the intensity. This is to help the identification of a clear Gaussian
+        ## peak. the binsizes are controlled by binSize, and the binRange specified.
+        histData, binEdges = np.histogram(data[xVar], weights=data["Intensity"], bins = np.arange(minVal, maxVal, binSize))
+        binCenters = binEdges[:-1]  + (binEdges[1] - binEdges[0])
+    result = {"xVar": xVar, "integrationVar1": integrationVar1, "integrationVal1": integrationVal1,
+              "integrationWidth1": integrationWidth1, "integrationVar2": integrationVar2,
+              "integrationVal2": integrationVal2, "integrationWidth2": integrationWidth2,
+              "binCenters": binCenters, "histogram": histData, "minVal": minVal, "maxVal": maxVal,
+              "bestValues": None, "bestFit": None, "failed": True}
+    ## With no bins inside binRange there is nothing to fit, so it is marked as failed
+    if len(binCenters) == 0:
+        return result
+    ## Now the index of the peak is found, which is essential for the Gaussian fitting
+    ## The prominence term controls the minimum height it will look for for fitting
+    ## The distance variable sets the minimum distance between peaks, and is there to help prevent
+    ## overfitting. This is the the most nitpicky of the variables, and is highly dependent on
+    ## where you are fitting. Currently I have it set such that the distance scales automatically
+    ## with the number of bins, but the exact scale factor is tricky. Optimization may be needed
+    ## here.
+    i_pk, _ = scipy.signal.find_peaks(histData, distance = len(binCenters)//3, prominence = threshold)
+
+    ## Now we prepare the gaussian fitting package using LmFit.
+    gaussModel = GaussianModel()
+    ## this is the natural sequence for looking at multiple Gaussians.
+    pars = gaussModel.guess(data=histData, x = binCenters)
+    modelList = []
+    ## setting up the initial guesses which it will refine from,.
+    ## the procedure is identical to that described in Calibration.py
+    ## For more details refer to there.
+    for i in range(len(i_pk)):
+        peak_index = i_pk[i]
+        gauss = GaussianModel(prefix=f'g{i+1}_')
+        pars.update(gauss.make_params())
+        pars[f'g{i+1}_center'].set(binCenters[peak_index])
+        pars[f'g{i+1}_sigma'].set(0.1)
+        pars[f'g{i+1}_amplitude'].set(histData[peak_index])
+        modelList.append(gauss)
+    modelArray = np.array(modelList)
+    model = np.sum(modelArray)
+    ## this is the actual fitting procedure
+    try:
+        with stage("cut1D fit") as timer:
+            timer.eventsParsed = len(histData)
+            out = model.fit(histData, pars, x=binCenters)
+    except:
+        ## If the fit fails, which can happen particularly if your binRange doesn't capture any peaks
+        ## (slope=0), it is marked as failed
+        return result
+    result["bestValues"] = out.best_values
+    result["bestFit"] = out.best_fit
+    result["failed"] = False
+    return result
+
+## _sweepFits() runs cut1DData() of resVar for each point num of sweep, integrating xVar over num +- xWidth and
+## integrationVar over integrationVal +- integrationWidth, for resolutionData() and cut2DErrorData(). It yields
+## (num, cut) in the order of sweep, where cut is what cut1DData() returned, or the error if it raised one.
+## With workers the points are spread over that many processes. The events inside the integration volume of
+## integrationVar are written once (only the columns cut1DData() needs) to a temporary event store (see EventStore.py),
+## which every process memory-maps, so the events are shared between the processes rather than copied to each one.
+def _sweepFits(dataframe, xVar, sweep, xWidth, resVar, binSize, integrationVar, integrationVal,
+               integrationWidth, threshold, binRange, workers):
+    cutArgs = {"xVar": resVar, "binSize": binSize, "integrationVar1": integrationVar,
+               "integrationVal1": integrationVal, "integrationWidth1": integrationWidth, "integrationVar2": xVar,
+               "integrationWidth2": xWidth, "threshold": threshold, "binRange": binRange}
+    ## A DataCube is already small, so it is always used in this process
+    if workers == None or workers == 1 or isinstance(dataframe, DataCube):
+        for num in sweep:
+            try:
+                cut = cut1DData(dataframe = dataframe, integrationVal2 = num, **cutArgs)
+            except Exception as error:
+                cut = error
+            yield num, cut
+        return
+    data = _integrationVolume(dataframe, [(integrationVar, (integrationVal, integrationWidth))])
+    columns = list(dict.fromkeys([integrationVar, xVar, resVar, "Intensity"]))
+    tempFolder = tempfile.mkdtemp(prefix = "pcpa_sweep_")
+    path = os.path.join(tempFolder, "events")
+    saveEvents(pd.DataFrame({column: np.asarray(data[column]) for column in columns}), path)
+    executor = ProcessPoolExecutor(max_workers = workers, initializer = _initSweepWorker, initargs = (path, cutArgs))
+    try:
+        ## executor.map() returns the results in the order of sweep
+        if profilingEnabled():
+            ## The stages of each point are sent back from the worker with its cut (see Profiling.py)
+            cuts = collectProfiles(executor.map(partial(profiledCall, _sweepWorker), sweep))
+        else:
+            cuts = executor.map(_sweepWorker, sweep)
+        for num, cut in zip(sweep, cuts):
+            yield num, cut
+    finally:
+        executor.shutdown(wait = True, cancel_futures = True)
+        shutil.rmtree(tempFolder, ignore_errors = True)
+
+## _sweepArgs holds the memory-mapped events and the cut1DData() arguments in each worker process of _sweepFits()
+_sweepArgs = None
+def _initSweepWorker(path, cutArgs):
+    global _sweepArgs
+    _sweepArgs = (loadEvents(path), cutArgs)
+def _sweepWorker(num):
+    data, cutArgs = _sweepArgs
+    try:
+        return cut1DData(dataframe = data, integrationVal2 = num, **cutArgs)
+    except Exception as error:
+        return error
+
+## _sweep() runs the sweep of resolutionData() and cut2DErrorData() over xVar and sorts the points into
+## the ones with a single Gaussian peak, the ones where the fit failed, and the ones with multiple peaks.
+def _sweep(dataframe, xVar, xStepSize, xWidth, resVar, binSize, integrationVar, integrationVal, integrationWidth,
+           threshold, binRange, xlim, workers):
+    ## This controls the range which the resolution is calculated
+    ## If not specified, it'll just go to the min and max values within the dataframe
+    if xlim == None:
+        xMin, xMax = _variableRange(dataframe, xVar)
+    else:
+        xMin, xMax = xlim[0], xlim[1]
+    result = {"x": [], "bestValues": [], "failed": [], "multiplePeaks": [], "cuts": []}
+    for num, cut in _sweepFits(dataframe, xVar, np.arange(xMin, xMax, xStepSize), xWidth, resVar, binSize,
+                               integrationVar, integrationVal, integrationWidth, threshold, binRange, workers):
+        ## Some values may not work. However, in some cases this is quite normal so the sweep continues.
+        if isinstance(cut, Exception) or (cut != None and cut["failed"] == True):
+            result["failed"].append(num)
+            continue
+        if cut == None:
+            continue
+        result["cuts"].append(cut)
+        ## As the fit will automatically try fitting multiple Gaussians, any point in which multiple
+        ## peaks are found is kept apart. This is when the binRange and threshold parameters are extremely useful.
+        if "g2_center" in cut["bestValues"]:
+            result["multiplePeaks"].append(num)
+            continue
+        result["x"].append(num)
+        result["bestValues"].append(cut["bestValues"])
+    return result
+
+## resolutionData() calculates the resolution of resolution() in Plotting.py (see there for the arguments).
+## The result has "x" (the points of xVar) and "fwhm" (the FWHM of resVar at each of them), "failed" and
+## "multiplePeaks" (the points where the fit failed or found more than one peak), "cuts" (the cut1DData() result
+## of every point that was fitted) and the variables. It returns None if one of the variables is wrong.
+def resolutionData(dataframe, xVar, xStepSize, resVar, binSize, integrationVar, integrationVal, integrationWidth,
+                   threshold = None, binRange = None, xlim = None, method = "fit", refine = False, workers = None):
+    if _checkVariables(dataframe, [integrationVar, xVar, resVar]) == False:
+        return None
+    if method == "moments":
+        ## Every point of the sweep is calculated at once by resolutionMoments()
+        xVarList, resList = resolutionMoments(dataframe, xVar, xStepSize, resVar, binSize, integrationVar,
+                                              integrationVal, integrationWidth, binRange = binRange,
+                                              xlim = xlim, refine = refine)
+        return {"xVar": xVar, "resVar": resVar, "x": xVarList, "fwhm": resList, "failed": [],
+                "multiplePeaks": [], "cuts": []}
+    result = _sweep(dataframe, xVar, xStepSize, xStepSize/2, resVar, binSize, integrationVar, integrationVal,
+                    integrationWidth, threshold, binRange, xlim, workers)
+    return {"xVar": xVar, "resVar": resVar, "x": result["x"],
+            "fwhm": [bestValues['g1_sigma']*2.355 for bestValues in result["bestValues"]],
+            "failed": result["failed"], "multiplePeaks": result["multiplePeaks"], "cuts": result["cuts"]}
+
+## cut2DErrorData() calculates the error bars of cut2DError() in Plotting.py (see there for the arguments).
+## The result has "x" (the points of xVar), "centers" (the fitted center of yVar at each point) and "errors"
+## (half the FWHM), "failed", "multiplePeaks" and "cuts" as in resolutionData(), "data" (the events inside the
+## integration volume of integrationVar, which cut2DError() draws behind the error bars) and the variables.
+def cut2DErrorData(dataframe, xVar, xStepSize, xWidth, binSize, yVar, integrationVar, integrationVal, integrationWidth,
+                   xlim = None, threshold = None, binRange = None, workers = None):
+    if _checkVariables(dataframe, [integrationVar, xVar, yVar]) == False:
+        return None
+    data = _integrationVolume(dataframe, [(integrationVar, (integrationVal, integrationWidth))])
+    result = _sweep(dataframe, xVar, xStepSize, xWidth, yVar, binSize, integrationVar, integrationVal,
+                    integrationWidth, threshold, binRange, xlim, workers)
+    return {"xVar": xVar, "yVar": yVar, "integrationVar": integrationVar, "integrationVal": integrationVal,
+            "integrationWidth": integrationWidth, "data": data, "x": result["x"],
+            "centers": [bestValues['g1_center'] for bestValues in result["bestValues"]],
+            "errors": [bestValues['g1_sigma']*2.355/2 for bestValues in result["bestValues"]],
+            "failed": result["failed"], "multiplePeaks": result["multiplePeaks"], "cuts": result["cuts"]}
+
+## resolutionMoments() is the fast version of the sweep in resolution(). Rather than selecting, histogramming and
+## fitting each point of the sweep separately, every point is histogrammed at once in a single 2D histogram of
+## xVar (in steps of xStepSize, so each point covers num +- xStepSize/2 like in resolution()) against resVar
+## (in bins of binSize). The width of each point is then found from the moments of its column of the histogram:
+## sigma is the square root of the intensity weighted variance of resVar, and the FWHM is sigma*2.355, the same
+## as for the Gaussian fit. This assumes there is a single peak in each column, so binRange (the range of resVar
+## that is used) should be set around the peak if there is any background or a second peak.
+## With refine = True each column is also fitted with a single Gaussian by LmFit, starting from the moments,
+## which is slower but is what the fit in cut1D() would give for a single peak.
+## The arguments are the same as resolution(), and it returns the same (xVarList, resList) without plotting.
+def resolutionMoments(dataframe, xVar, xStepSize, resVar, binSize, integrationVar, integrationVal, integrationWidth,
+                      binRange = None, xlim = None, refine = False):
+    if isinstance(dataframe, DataCube):
+        raise TypeError("resolutionMoments() needs the events, please use the dataframe or an EventIndex instead of a DataCube!")
+    if _checkVariables(dataframe, [integrationVar]) == False:
+        return ([], [])
+    data = _integrationVolume(dataframe, [(integrationVar, (integrationVal, integrationWidth))])
+    if xlim == None:
+        xMin, xMax = _variableRange(dataframe, xVar)
+    else:
+        xMin, xMax = xlim[0], xlim[1]
+    sweep = np.arange(xMin, xMax, xStepSize)
+    resValues = np.asarray(data[resVar])
+    if len(sweep) == 0 or len(resValues) == 0:
+        return ([], [])
+    if binRange == None:
+        minVal, maxVal = resValues.min(), resValues.max()
+    else:
+        minVal, maxVal = binRange[0], binRange[1]
+    xEdges = np.append(sweep - xStepSize/2, sweep[-1] + xStepSize/2)
+    resEdges = np.arange(minVal, maxVal, binSize)
+    hist, _, _ = np.histogram2d(np.asarray(data[xVar]), resValues, bins = [xEdges, resEdges],
+                                weights = np.asarray(data["Intensity"]))
+    binCenters = (resEdges[:-1] + resEdges[1:])/2
+    ## The moments of every column are found together
+    total = hist.sum(axis = 1)
+    found = np.flatnonzero(total > 0)
+    hist = hist[found]
+    centers = hist @ binCenters/total[found]
+    sigmas = np.sqrt(np.sum(hist * (binCenters[np.newaxis, :] - centers[:, np.newaxis])**2, axis = 1)/total[found])
+    if refine == True:
+        gaussModel = GaussianModel()
+        for i in range(len(found)):
+            pars = gaussModel.make_params(center = centers[i], sigma = max(sigmas[i], binSize),
+                                          amplitude = total[found[i]]*binSize)
+            try:
+                out = gaussModel.fit(hist[i], pars, x = binCenters)
+            except:
+                ## If the fit fails the moments are kept for that point
+                continue
+            sigmas[i] = abs(out.best_values["sigma"])
+    return (list(sweep[found]), list(sigmas*2.355))
+
+## histogramChunks() histograms a dataset that is handed over a piece at a time, for example by
+## dataLoaderChunks() in DataLoader.py, so datasets larger than memory can still be histogrammed.
+## variables is a list of the variables to histogram (e.g. ["Qx", "E"]) and bins is a list with the
+## bin edges of each variable (e.g. [np.arange(-3, 3, 0.05), np.arange(0, 2, 0.02)]). The bin edges
+## have to be given explicitly so that every piece is histogrammed onto the same bins.
+## windows (optional) is a dict of integration volumes {integrationVar: (integrationVal, integrationWidth), ...}
+## where only the events with integrationVal - integrationWidth < integrationVar < integrationVal + integrationWidth
+## are kept, the same as in cut2D() and cut1D(). The histogram is weighted by the intensity.
+## It returns the histogram and the bin edges, like np.histogramdd().
+def histogramChunks(chunks, variables, bins, windows = None):
+    hist = np.zeros([len(edges)-1 for edges in bins])
+    for chunk in chunks:
+        mask = np.ones(len(chunk), dtype = bool)
+        if windows != None:
+            for integrationVar, (integrationVal, integrationWidth) in windows.items():
+                values = np.asarray(chunk[integrationVar])
+                mask &= (values > integrationVal - integrationWidth) & (values < integrationVal + integrationWidth)
+        sample = [np.asarray(chunk[variable])[mask] for variable in variables]
+        chunkHist, binEdges = np.histogramdd(sample, bins = bins, weights = np.asarray(chunk["Intensity"])[mask])
+        hist += chunkHist
+    return hist, [np.asarray(edges) for edges in bins]
@@ -0,0 +1,94 @@
+## The Benchmark module times the slow parts of the code on synthetic data (see SyntheticData.py), so that the
+## effect of a change on calibration(), dataLoader(), the cuts and the resolution sweeps can be measured and
+## compared between versions. For every scale (a number of scan point folders and a number of events per file)
+## a dataset is written once and every stage is timed on it:
+##   results = runBenchmarks("/tmp/pcpaBenchmark", scales = [(4, 1000), (16, 5000), (64, 20000)])
+## or from the command line, which also saves the table as benchmark.csv inside the benchmark folder:
+##   python Benchmark.py /tmp/pcpaBenchmark
+## The datasets are kept in the benchmark folder, so running the benchmark again (e.g. after a change) only times the code.
+## Their folder names hold the design and the number of events, so a benchmark of another design or scale writes its own.
+
+##Here are the necessary import statements for this file
+import numpy as np
+import pandas as pd
+import os
+import sys
+import time
+from Instrument_Creator import Instrument
+from Calibration import calibration
+from DataLoader import dataLoader
+from Analysis import cut2DData, cut1DData, resolutionData
+from SyntheticData import syntheticCalibration, syntheticData
+
+## The scales used if none are given: (number of scan point folders, events per .psd file)
+defaultScales = [(4, 1000), (16, 2000), (32, 10000)]
+
+## designTag() names the design of the instrument (type, stations and mosaic) in the folders of the benchmark,
+## so benchmarks of different designs can share a benchmark folder without reading each other's files
+def designTag(instrument):
+    return f"{instrument.type.replace(' ', '_')}_{instrument.stations}_{instrument.mosaic}"
+
+## benchmarkDataset() writes the data folder of a scale (if it isn't there already) and returns its name
+def benchmarkDataset(instrument, folderNum, eventsPerFile):
+    folder = f"data_{designTag(instrument)}_{folderNum}x{eventsPerFile}"
+    if not os.path.isdir(os.path.join(instrument.pathBase, folder)):
+        syntheticData(instrument, folder, psiList = np.arange(folderNum)*2., eventsPerFile = eventsPerFile)
+    return folder
+
+## timeStage() runs stage() repeats times and returns the result of the last run and the fastest time in seconds
+def timeStage(stage, repeats):
+    times = []
+    for repeat in range(repeats):
+        start = time.perf_counter()
+        result = stage()
+        times.append(time.perf_counter() - start)
+    return result, min(times)
+
+## runBenchmarks() times every stage at every scale and returns a dataframe with a row for each stage and scale,
+## with the number of scan point folders, the events per file, the number of events in the dataframe and the fastest time.
+## The calibration row has the number of calibration energies (one folder each) in "energies" instead of "folders".
+## The design is set by stations, mosaic and type. workers is passed to calibration(), dataLoader() and the fit
+## sweep of resolutionData(); by default everything runs in this process. repeats is the number of times each stage
+## is run (the fastest is kept, which is the least affected by anything else running on the machine).
+def runBenchmarks(pathBase, scales = None, stations = 8, mosaic = 60, type = "full", workers = None, repeats = 1,
+                  calibrationEvents = 2000):
+    if scales == None:
+        scales = defaultScales
+    instrument = Instrument(stations, mosaic, pathBase, type)
+    calibrationFolder = f"calibration_{designTag(instrument)}_{calibrationEvents}"
+    if not os.path.isdir(os.path.join(pathBase, calibrationFolder)):
+        syntheticCalibration(instrument, calibrationFolder, eventsPerFile = calibrationEvents)
+    rows = []
+    calibrationDF, seconds = timeStage(lambda: calibration(instrument, calibrationFolder, workers = workers), repeats)
+    rows.append({"stage": "calibration", "energies": len(instrument.energyList()), "eventsPerFile": calibrationEvents,
+                 "seconds": seconds})
+    for folderNum, eventsPerFile in scales:
+        folder = benchmarkDataset(instrument, folderNum, eventsPerFile)
+        data, seconds = timeStage(lambda: dataLoader(instrument, calibrationDF, folder, workers = workers), repeats)
+        ## The cuts are taken through the middle of the data
+        qy = float(np.median(data["Qy"]))
+        energy = float(np.median(data["E"]))
+        qxRange = [float(data["Qx"].min()), float(data["Qx"].max())]
+        stages = [("dataLoader", None),
+                  ("cut2D", lambda: cut2DData(data, "E", energy, 0.05)),
+                  ("cut1D", lambda: cut1DData(data, "E", 0.02, "Qx", np.mean(qxRange), 0.05, "Qy", qy, 0.1)),
+                  ("resolution fit", lambda: resolutionData(data, "Qx", 0.1, "E", 0.02, "Qy", qy, 0.1, xlim = qxRange,
+                                                            workers = workers)),
+                  ("resolution moments", lambda: resolutionData(data, "Qx", 0.1, "E", 0.02, "Qy", qy, 0.1, xlim = qxRange,
+                                                                method = "moments"))]
+        for stageName, stage in stages:
+            if stage != None:
+                _, seconds = timeStage(stage, repeats)
+            rows.append({"stage": stageName, "folders": folderNum, "eventsPerFile": eventsPerFile,
+                         "events": len(data), "seconds": seconds})
+    return pd.DataFrame(rows, columns = ["stage", "folders", "energies", "eventsPerFile", "events", "seconds"])
+
+if __name__ == "__main__":
+    ## The benchmark folder is the first argument, or a "pcpaBenchmark" folder in the current directory
+    if len(sys.argv) > 1:
+        pathBase = os.path.abspath(sys.argv[1])
+    else:
+        pathBase = os.path.abspath("pcpaBenchmark")
+    results = runBenchmarks(pathBase)
+    results.to_csv(os.path.join(pathBase, "benchmark.csv"), index = False)
+    print(results.to_string(index = False))
@@ -0,0 +1,111 @@
+## The Cache module keeps results that are expensive to recompute on disk so they can be reloaded
+## in a later session. Currently it is used for the calibration matrix from Calibration.py.
+## Everything is stored in a hidden ".pcpa_cache" folder inside the instrument's pathBase (unless
+## another cacheDir is given), and every file is named by a key built from the instrument
+## configuration and a fingerprint of the data folder, so a changed design or changed data
+## simply produces a new key rather than reusing an old result.
+
+##Here are the necessary import statements for this file
+import numpy as np
+import pandas as pd
+import scipy.sparse
+import os
+import json
+import hashlib
+import tempfile
+
+## cacheVersion is part of every key. If the way a cached result is calculated ever changes,
+## bumping this number makes sure old cache files are no longer used.
+cacheVersion = 1
+
+## cacheDirectory() returns (and creates if needed) the folder where cache files are written
+def cacheDirectory(instrument, cacheDir = None):
+    if cacheDir == None:
+        cacheDir = os.path.join(instrument.pathBase, ".pcpa_cache")
+    os.makedirs(cacheDir, exist_ok = True)
+    return cacheDir
+
+## folderFingerprint() summarizes the contents of a folder (and all its subfolders) as a short hash.
+## With method = "mtime" the name, size and modification time of every file is used, which only requires
+## a stat() of each file. With method = "content" every file is read and hashed, which is slower but
+## does not depend on modification times (useful if the data was copied between machines).
+def folderFingerprint(folderPath, method = "mtime"):
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(folderPath):
+        ## os.walk does not guarantee an order, so everything is sorted to keep the fingerprint stable
+        dirs.sort()
+        ## The cache folder itself is never part of the fingerprint
+        if ".pcpa_cache" in dirs:
+            dirs.remove(".pcpa_cache")
+        for file in sorted(files):
+            filePath = os.path.join(root, file)
+            digest.update(os.path.relpath(filePath, folderPath).encode())
+            if method == "content":
+                with open(filePath, "rb") as fileOpener:
+                    for block in iter(lambda: fileOpener.read(1 << 20), b""):
+                        digest.update(block)
+            else:
+                stat = os.stat(filePath)
+                digest.update(f"{stat.st_size}_{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+## arrayFingerprint() is a hash of the values of numpy arrays, for example to tell whether two calibrations are the same
+def arrayFingerprint(*arrays):
+    digest = hashlib.sha256()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(str(array.dtype).encode() + str(array.shape).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+## sparseCalibration() turns the calibration dataframe into a scipy.sparse CSR matrix with the same layout
+## (a row for each Ef and a column for each pixel). Each pixel only maps to the few Efs near its analyzer strip
+## and the baffle pixels are all zeros, so most of the calibration is zeros and doesn't need to be stored.
+## dataLoader(sparse = True) uses it for the redistribution. It is kept here rather than in Calibration.py so
+## DataLoader.py doesn't have to import matplotlib and lmfit.
+def sparseCalibration(calibration):
+    return scipy.sparse.csr_matrix(np.array(calibration))
+
+## instrumentConfiguration() collects everything about the instrument that changes the calibration
+def instrumentConfiguration(instrument):
+    return {"stations": instrument.stations, "mosaic": instrument.mosaic, "type": instrument.type,
+            "baffleRegions": [list(baffleRegion) for baffleRegion in instrument.baffleRegions()],
+            "energyList": instrument.energyList(), "startpoint": instrument.startpoint()}
+
+## cacheKey() turns any json-serializable description (a dict) into the hash used for the file names
+def cacheKey(description):
+    description = dict(description, cacheVersion = cacheVersion)
+    return hashlib.sha256(json.dumps(description, sort_keys = True).encode()).hexdigest()
+
+## calibrationCachePath() gives the file where the calibration from a given folder is cached.
+## The key covers the instrument configuration and the fingerprint of the calibration folder.
+def calibrationCachePath(instrument, folder, cacheDir = None, fingerprint = "mtime"):
+    description = instrumentConfiguration(instrument)
+    description["folder"] = folder
+    description["fingerprint"] = folderFingerprint(os.path.join(instrument.pathBase, folder), fingerprint)
+    key = cacheKey(description)
+    return os.path.join(cacheDirectory(instrument, cacheDir),
+                        f"calibration_{instrument.stations}_Stations_Mosaic_{instrument.mosaic}_{key[:16]}.npz")
+
+## saveCalibration() writes the calibration dataframe as a compressed .npz file with the matrix,
+## the Efs (the index) and the pixel centers (the columns).
+## The calibration is mostly zeros (baffle regions and pixels far from an analyzer strip), so it compresses well.
+def saveCalibration(calibrationDF, filePath):
+    ## The file is written under a temporary name and then renamed, so a calibration that is interrupted
+    ## halfway through writing never leaves a broken cache file behind. Each call gets its own temporary file,
+    ## since the same calibration can be saved by several processes at once (e.g. runDesignSweep() in DesignSweep.py).
+    fileDescriptor, tempPath = tempfile.mkstemp(dir = os.path.dirname(filePath), prefix = os.path.basename(filePath) + ".",
+                                                suffix = ".tmp")
+    try:
+        with os.fdopen(fileDescriptor, "wb") as fileOpener:
+            np.savez_compressed(fileOpener, matrix = calibrationDF.to_numpy(), efs = np.array(calibrationDF.index),
+                                pixels = np.array(calibrationDF.columns))
+        os.replace(tempPath, filePath)
+    finally:
+        if os.path.exists(tempPath):
+            os.remove(tempPath)
+
+## loadCalibration() reads a file written by saveCalibration() back into the same dataframe
+def loadCalibration(filePath):
+    with np.load(filePath) as cacheFile:
+        return pd.DataFrame(cacheFile["matrix"], index = cacheFile["efs"], columns = cacheFile["pixels"])
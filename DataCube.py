@@ -0,0 +1,93 @@
+## The DataCube module holds the events of a dataset as a binned, intensity weighted histogram over (Qx, Qy, E),
+## which is how triple-axis and CAMEA data is usually reduced. The events are histogrammed once, and every cut
+## after that is only a sum over part of the cube, so it doesn't depend on the number of events any more.
+## The cost is that the cuts can only be as fine as the bins of the cube, and the integration volumes are
+## rounded to whole bins (a bin is used if its center is inside the integration volume).
+## A DataCube can be passed to cut2D(), cut1D(), resolution() and cut2DError() in Plotting.py in place of the dataframe:
+##   mantaCube = dataCube(mantaData, [0.02, 0.02, 0.01])
+##   cut2D(instrument, mantaCube, "Qx", "Qy", "E", 1.0, 0.05)
+
+##Here are the necessary import statements for this file
+import numpy as np
+
+class DataCube:
+    ## hist is the histogram, with one axis for each of the variables, and edges is the list of the bin edges of each variable
+    def __init__(self, hist, edges, variables):
+        self.hist = hist
+        self.edges = [np.asarray(binEdges) for binEdges in edges]
+        self.variables = list(variables)
+
+    @property
+    def columns(self):
+        return self.variables
+
+    def centers(self, variable):
+        binEdges = self.edges[self.variables.index(variable)]
+        return (binEdges[:-1] + binEdges[1:])/2
+
+    ## cut() integrates the cube over the integration volumes in windows, a dict {integrationVar: (integrationVal, integrationWidth), ...}
+    ## (or a list of (integrationVar, (integrationVal, integrationWidth)) pairs), and returns the smaller cube of the
+    ## variables that are left. The bins with integrationVal - integrationWidth < center < integrationVal + integrationWidth are summed.
+    def cut(self, windows):
+        if isinstance(windows, dict):
+            windows = list(windows.items())
+        hist = self.hist
+        edges = list(self.edges)
+        variables = list(self.variables)
+        for integrationVar, (integrationVal, integrationWidth) in windows:
+            if integrationVar not in variables:
+                raise KeyError(integrationVar)
+            axis = variables.index(integrationVar)
+            centers = (edges[axis][:-1] + edges[axis][1:])/2
+            keep = (centers > integrationVal - integrationWidth) & (centers < integrationVal + integrationWidth)
+            hist = np.compress(keep, hist, axis = axis).sum(axis = axis)
+            del edges[axis]
+            del variables[axis]
+        return DataCube(hist, edges, variables)
+
+    ## rebin() joins every factor bins of variable into one bin (any bins left over at the end are dropped)
+    def rebin(self, variable, factor):
+        axis = self.variables.index(variable)
+        binNum = (self.hist.shape[axis] // factor) * factor
+        hist = np.take(self.hist, np.arange(binNum), axis = axis)
+        shape = list(hist.shape)
+        shape[axis:axis+1] = [binNum // factor, factor]
+        edges = list(self.edges)
+        edges[axis] = edges[axis][:binNum+1:factor]
+        return DataCube(hist.reshape(shape).sum(axis = axis + 1), edges, self.variables)
+
+    ## save() writes the cube as an .npz file, which can be read back with loadCube()
+    def save(self, path):
+        np.savez_compressed(path, hist = self.hist, variables = np.array(self.variables),
+                            **{f"edges{axis}": binEdges for axis, binEdges in enumerate(self.edges)})
+
+def loadCube(path):
+    with np.load(path) as cubeFile:
+        variables = [str(variable) for variable in cubeFile["variables"]]
+        return DataCube(cubeFile["hist"], [cubeFile[f"edges{axis}"] for axis in range(len(variables))], variables)
+
+## cubeEdges() makes bin edges of width binWidth that cover values
+def cubeEdges(values, binWidth):
+    values = np.asarray(values)
+    minVal, maxVal = float(values.min()), float(values.max())
+    return minVal + binWidth*np.arange(int(np.floor((maxVal - minVal)/binWidth)) + 2)
+
+## dataCube() histograms a dataframe from dataLoader() (or an EventTable or EventIndex) into a DataCube.
+## binWidths is the width of the bins of each variable, either one number for all of them or a list.
+## The bins cover the full range of each variable.
+def dataCube(data, binWidths, variables = ("Qx", "Qy", "E")):
+    ## histogramChunks() is imported here, because Analysis.py imports this module
+    from Analysis import histogramChunks
+    if np.ndim(binWidths) == 0:
+        binWidths = [binWidths] * len(variables)
+    bins = [cubeEdges(data[variable], binWidth) for variable, binWidth in zip(variables, binWidths)]
+    hist, edges = histogramChunks([data], variables, bins)
+    return DataCube(hist, edges, variables)
+
+## chunkCube() builds the DataCube from pieces of a dataset, such as the ones from dataLoaderChunks() in DataLoader.py,
+## so a cube can be made from a dataset larger than memory. Since the range of the data isn't known ahead of time,
+## bins is the list of the bin edges of each variable (e.g. [np.arange(-3, 3, 0.02), np.arange(-3, 3, 0.02), np.arange(0, 2, 0.01)]).
+def chunkCube(chunks, bins, variables = ("Qx", "Qy", "E")):
+    from Analysis import histogramChunks
+    hist, edges = histogramChunks(chunks, variables, bins)
+    return DataCube(hist, edges, variables)
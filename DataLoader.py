@@ -14,8 +14,19 @@
 ##Various import statements used throughout the module
 import numpy as np
 import os
+import json
 import pandas as pd
+import scipy.sparse
 from tqdm import tqdm
+from functools import partial
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from PSDReader import histogramPSD
+from EventStore import saveEvents, loadEvents, appendEvents, storeMetadata, storePath
+from Cache import folderFingerprint, arrayFingerprint, sparseCalibration
+from EventTable import compactEvents, compactFrame
+from Profiling import stage, profilingEnabled, profiledCall, collectProfiles
+from ScanIndex import scanIndex, scanIndexFile, readScanParameters, selectScans
 
 ## These functions are simple ways to calculate qx and qy from the experimental parameters
 ## based on the sample angle and twotheta (scattering angle)
@@ -33,194 +44,428 @@ def qy_calculator(ki, kf, twoth, sampleAng):
     Qy = ki*np.sin(-1*sampleAngRad) - kf*np.sin(-1*sampleAngRad + twothrad)
     return Qy
 
+## folderEvents() does all the work for a single scan point, i.e. a single folder of a simulation
+## with one Ei, Two Theta and sample angle. It returns the events of that folder as an array with the
+## row format [Ei, Ef, twoth, sampleAng, Intensity], or None if the folder could not be read.
+## Each folder is independent of every other folder, which is what lets dataLoader() hand the folders to
+## several processes. calibrationArr is the calibration as a numpy array and efs are the Efs
+## of the calibration (calibration.index).
+## All the tubes of the folder are histogrammed first and then redistributed with a single matrix product.
+## If calibrationArr is a scipy.sparse matrix (see sparseCalibration() in Cache.py), the redistribution
+## uses the sparse product and only the Efs that received some intensity are kept as events.
+## channels, tubes and twothRange (optional) choose which tubes are read, see dataLoader(). The tubes that
+## are left out are never opened.
+def folderEvents(instrument, calibrationArr, efs, folderPath, params = None, channels = None, tubes = None,
+                 twothRange = None):
+    ## Every file is opened through its absolute path rather than changing the working directory
+    ## with os.chdir(), so several folders (or several datasets) can be read at the same time
+    folderPath = os.path.abspath(folderPath)
+    if not os.path.isdir(folderPath):
+        print(f"{os.path.basename(folderPath)} is not a folder!")
+        return None
+    ## Essentially toy models only have one angular channel while the full
+    ## instrument has 8, this just reflects that for reading the data
+    if instrument.type == "toy model":
+        channelNum = 1
+    elif instrument.type == "full":
+        channelNum = 8
+    ## histograms will hold the histogrammed data of every tube in the folder as a (tubes x 1024) matrix.
+    ## It is allocated once for the largest possible number of tubes (13 per angular channel), and
+    ## tubeTwoths keeps the twotheta of each tube that was found.
+    histograms = np.zeros((13*channelNum, len(instrument.pixelCenters())))
+    tubeTwoths = []
+    ## This section is just to read the angle twotheta Ei, and sample Angle
+    ## It is designed for McStas ReuterStokes.psd files. which also produce
+    ## psdtube.dat files. ReuterStokes.psd files contain the actual data
+    ## but aren't created unless a neutron lands in the specific tube.
+    ## However psdtube.dat files, despite not containing the actual data
+    ## are always created, which is why they're useful for extracting
+    ## experimental parameters.
+
+    ## params are the scan parameters from the index of the data folder (see ScanIndex.py). If they aren't given,
+    ## only the header of psd_tube1_1a.dat is read to find them.
+    if params == None:
+        params = readScanParameters(os.path.join(folderPath, "psd_tube1_1a.dat"))
+    ## A folder without psd_tube1_1a.dat (or without the parameters in it) is skipped, the rest of the data is still loaded
+    if params == None:
+        if not os.path.exists(os.path.join(folderPath, "psd_tube1_1a.dat")):
+            print(f"Could not find psd_tube1_1a.dat in {os.path.basename(folderPath)}")
+        else:
+            print(f"Something went wrong defining Ei, Two Theta, and the Sample Angle for File {os.path.basename(folderPath)}")
+        return None
+    Ei = params["Ei"]
+    ## twothBase is the rotation of the entire angular detection system
+    ## So there are several angles within the CAMEA/MANTA subsystem that 
+    ## are increased by the constant term twoThBase
+    twothBase = params["TwoTh"]
+    sampleAng = params["psi"]
+    ## There are 8 angular channnels of detectors (controlled by channel and channelNum)
+    ## there are 2 rows of detectors, the bottom row has 7 detectors and the top has 6 detectors
+    ## the 6 on the top row are placed in between the 7, so each has a slightly different twoth
+    for detRow in range(1, 3):
+        if detRow == 1:
+            detNum = 7
+            ## there are the different angles within the bottom row of the tube relative
+            ## to the center of the angular channel
+            detAngList = np.array([-3.33, -2.22, -1.11, 0., 1.11, 2.22, 3.33])
+            ## I think defining detAngList within the for loop is slightly less efficient
+            ## but after tests it hardly seems to matter and it improves readability if its
+            ## in the for loop. Future readers of code feel free to change that.
+        elif detRow == 2:
+            detNum = 6
+            ## these are the different angles relative to the top row of the tube
+            ## relative to the center of the angular channel
+            detAngList = np.array([-2.775, -1.665, -0.555, 0.555, 1.665, 2.775])
+        for channel in range(1, channelNum+1):
+            if channels != None and channel not in channels:
+                continue
+            for det in range(detNum):
+                if tubes != None and (detRow, det+1) not in tubes:
+                    continue
+                ## below is the true twotheta of the tube based on the twoThBase
+                ## each angular channel will be rotated by 7.5 degrees from the past one
+                ## and each tube will be somewhere in the middle of the 7.5. degree span
+                ## based on detAngList
+
+                ## For example, if twoThBase = 12, and we are looking at 5th detector tube 
+                ## on the bottom row of the third channel, twoTh is calculated as
+                ## twoth = 12 - 1.11 + 2*7.5 = 25.89 degrees
+                twoth = twothBase - detAngList[det] + ((channel-1) * 7.5)
+                if twothRange != None and not (twothRange[0] <= twoth <= twothRange[1]):
+                    continue
+                try:
+                    ##Opening the data based on the detector
+                    ## histogramPSD() from PSDReader.py reads the intensity and the y position 
+                    ## (the vertical location where the neutron lands on the detector) of every event,
+                    ## ignores all 0 and "negative" intensity events, and then histograms the data
+                    ## with the same bins as in the calibration.
+                    histogrammedData = histogramPSD(os.path.join(folderPath, f"ReuterStokes{str(detRow)}_{str(det+1)}_{channel}.psd"), instrument.startpoint())
+                except FileNotFoundError:
+                    continue
+                ## Note that each file is histogrammed separately as each one will have slightly
+                ## different experimental parameters.
+                histograms[len(tubeTwoths)] = histogrammedData
+                tubeTwoths.append(twoth)
+    tubeNum = len(tubeTwoths)
+    histograms = histograms[:tubeNum]
+    ## Now I matrix multiply, once for the whole folder. Essentially it multiplies the (tubes x 1024)
+    ## matrix of histograms by the 1024 x N(Ef) calibration, turning it into a (tubes x N(Ef)) matrix
+    ## that has the intensities for each of the energies of each tube.
+    ## This is based off the prismatic weighting from the calibration.
+    with stage("calibration matmul") as timer:
+        if scipy.sparse.issparse(calibrationArr):
+            updatedintensities = (calibrationArr @ histograms.T).T
+        else:
+            updatedintensities = np.matmul(histograms, calibrationArr.T)
+        timer.eventsParsed = tubeNum
+        timer.eventsEmitted = tubeNum*len(efs)
+    ## next thing is creating a matrix of all the relevant parameters that will be needed
+    ## to calculate Q and E, with the following row format: [Ei, Ef, twoth, sampleAng, Intensity]
+    ## There is a row for each Ef of each tube, and the columns are filled by broadcasting:
+    ## Ef repeats for every tube, and each tube's twotheta repeats for every Ef.
+    fileEvents = np.empty((tubeNum, len(efs), 5))
+    fileEvents[:, :, 0] = Ei
+    ## the indices are the different Efs used from the calibration
+    fileEvents[:, :, 1] = efs
+    fileEvents[:, :, 2] = np.array(tubeTwoths)[:, np.newaxis]
+    fileEvents[:, :, 3] = sampleAng
+    fileEvents[:, :, 4] = updatedintensities
+    ## This step basically flattens the array so that we get a single matrix with 5 columns
+    ## with all the unique events being a different row
+    events = fileEvents.reshape(tubeNum*len(efs), 5)
+    if scipy.sparse.issparse(calibrationArr):
+        ## With the sparse calibration the Efs that end up with zero intensity are dropped
+        events = events[events[:, 4] != 0]
+    return events
+
 ## This is the main function users will call on that accesses all their data
 ## dataLoader() requires the instrument object, the calibration from Calibration.py
 ## and the name of the folder where the data is located. Note the folder containing the data
 ## must be located in the same directory as the calibration data.
-def dataLoader(instrument, calibration, folder):
+## workers is optional and sets the number of processes used to read the folders. By default
+## (workers = None) everything is read in this process. Each process reads whole scan point folders
+## and the events of all folders are joined at the end. Note that on Windows (or any system that
+## starts processes by spawning) the call needs to be inside an if __name__ == "__main__": block
+## when running from a script.
+## pool controls whether the workers are processes (pool = "process") or threads (pool = "thread").
+## Threads are useful when the data is on a network filesystem and most of the time is spent waiting on the disk.
+## dataLoader() never changes the working directory, so it is safe to call it from several threads at once.
+## store (optional) is the name of an event store (see EventStore.py) the dataframe is saved to after loading.
+## Like the saved figures, it is placed in the pathBase directory unless a full path is given. The next session
+## can then open the data with loadEvents() instead of reading the files again. storeType is passed to
+## saveEvents() as its dtype, e.g. storeType = np.float32 to halve the size of the store.
+## incremental = True (which needs a store) is meant for simulation campaigns where new folders keep appearing.
+## The store keeps a manifest of every folder with the names, sizes and modification times of its files, and
+## only folders that are new or have changed since the last call are read. The events of new folders are
+## appended to the store; if a folder changed or was removed the store is rewritten without its old events.
+## If the calibration changed, everything is read again.
+## sparse = True stores the calibration as a sparse (CSR) matrix. Each pixel only maps to the few Efs of its
+## analyzer strip, so this makes the redistribution faster, and only the (Ef, intensity) events with nonzero
+## intensity are kept, which makes the dataframe smaller. Events with zero intensity don't change any cuts or
+## fits, but note that they are then no longer drawn in the scatter plots of cut2D().
+## compact = True returns an EventTable (see EventTable.py) instead of the dataframe. It only keeps Ei, Ef, Two Theta,
+## Sample Angle and Intensity, as compactType (float32 by default), and calculates E, ki, kf, Qx and Qy when they
+## are first used, so it takes a fraction of the memory. It can be passed to the functions in Plotting.py like the dataframe.
+## The rest of the arguments load only part of the data, and are checked before any .psd file is opened:
+## eiRange and psiRange, given as (minimum, maximum) with both ends included, keep the scan point folders whose Ei and
+## sample angle psi are in range (from the scan index, see ScanIndex.py). channels is a list of the angular channels to
+## read (1 to 8), tubes is a list of (row, detector) pairs as in the file names ReuterStokes{row}_{detector}_{channel}.psd,
+## and twothRange keeps the tubes whose Two Theta is in range. For example, a cut near Two Theta = 40 at Ei = 5 meV
+##   dataLoader(instrument, mantaCalibration, "dataFolder", eiRange = (4.99, 5.01), twothRange = (35, 45))
+## only reads the few tubes of each folder that are needed.
+def dataLoader(instrument, calibration, folder, workers = None, pool = "process", store = None, storeType = None,
+               incremental = False, sparse = False, compact = False, compactType = np.float32, eiRange = None,
+               psiRange = None, twothRange = None, channels = None, tubes = None):
     ## Access all datafiles there, any unwanted files currently have to be removed manually.
-    allFiles = [f for f in os.listdir(f"{instrument.pathBase}/{folder}")]
-    ## events will be the temporary list that will contain the Ei, Efs, intensities, sample angle,
-    ## and twotheta of the simulation/data. It's the precursor to the pandas dataframe that will
-    ## be created. It's just faster to work with lists/numpy arrays before building the pandas
-    ## dataframe
-    events = []
+    dataPath = os.path.abspath(os.path.join(instrument.pathBase, folder))
+    with stage("file discovery") as timer:
+        ## The scan index (see ScanIndex.py) is kept in the data folder, but it isn't a scan point folder
+        allFiles = [f for f in os.listdir(dataPath) if not f.startswith(scanIndexFile)]
+        timer.eventsEmitted = len(allFiles)
+    ## The Ei, Two Theta and psi of every folder, from the scan index
+    scans = scanIndex(dataPath)
+    allFiles = _selectFolders(allFiles, scans, eiRange, psiRange)
+    selection = _tubeSelection(channels, tubes, twothRange)
     
     ## Now I turn the calibration pandas dataframe into an array
     ## It is faster to turn it into essentially a matrix than to work
     ## with the dataframe.
     calibrationArr = np.array(calibration)
-    
-    
-    ## Essentially toy models only have one angular channel while the full
-    ## instrument has 8, this just reflects that for reading the data
-    if instrument.type == "toy model":
-        channelNum = 1
-    elif instrument.type == "full":
-        channelNum = 8
-    ## This section sets up the tqdm progress bar (a convenience)
-    ## So users can track how long their data will take to load
-    progress = tqdm(allFiles)
-    progress.set_description("FilesRead/TotalFiles")
+    ## the indices are the different Efs used from the calibration
+    efs = np.array(calibration.index)
+    ## The store has to be read again if the calibration (or whether it is sparse, or the part of the data that is read) changed
+    calibrationKey = arrayFingerprint(calibrationArr, efs) + ("_sparse" if sparse == True else "")
+    if any(value != None for value in [eiRange, psiRange, twothRange, channels, tubes]):
+        calibrationKey += "_" + json.dumps([eiRange, psiRange, selection], default = str)
+    if sparse == True:
+        calibrationArr = sparseCalibration(calibration)
 
+    if incremental == True:
+        if store == None:
+            print("incremental = True needs a store to keep the events in!")
+            return None
+        path = storePath(instrument, store)
+        ## The manifest has the format {folder1: {"fingerprint": ..., "start": firstRow, "rows": numberOfRows}, ...}
+        fingerprints = {file: folderFingerprint(os.path.join(dataPath, file)) for file in allFiles}
+        manifest = {}
+        if os.path.exists(os.path.join(path, "metadata.json")):
+            metadata = storeMetadata(path)
+            if metadata.get("calibration") == calibrationKey:
+                manifest = metadata.get("manifest", {})
+        ## A folder is kept if it was read before and none of its files have changed
+        keptFolders = [file for file in manifest if fingerprints.get(file) == manifest[file]["fingerprint"]]
+        filesToRead = [file for file in allFiles if file not in keptFolders]
+    else:
+        filesToRead = allFiles
 
-    for file in progress:
-        ## Go to the directory
-        try:
-            os.chdir(f"{instrument.pathBase}/{folder}/{file}")            
-        except:
-            print(f"{file} is not a folder!")
-            continue
-        ## This section is just to read the angle twotheta Ei, and sample Angle
-        ## It is designed for McStas ReuterStokes.psd files. which also produce
-        ## psdtube.dat files. ReuterStokes.psd files contain the actual data
-        ## but aren't created unless a neutron lands in the specific tube.
-        ## However psdtube.dat files, despite not containing the actual data
-        ## are always created, which is why they're useful for extracting
-        ## experimental parameters.
-
-        ## I use this section to set up a true/false statement by having
-        ## the experimental parameters initially undefined.
-        twothBase = "undefined"
-        Ei = "undefined"
-        sampleAng = "undefined"
-        ##Opening and reading the data
-        try:
-            fileOpener = open("psd_tube1_1a.dat", "r")
-        except:
-            print(f"Could not find psd_tube1_1a.dat in {file}")
-            break
-        fileData = fileOpener.readlines()
-        ##This basically has it so it extracts the experimental parameters based on the structure of
-        ## the psd_tube.dat files
-        ## As soon as the three parameters, Ei, sampleAng, and twothBase are defined
-        ## the for loop breaks. 
-        for line in fileData:
-            splitLine = line.split()
-            if splitLine[1] == "Param:":
-                paramSplit = splitLine[2].split("=")
-                if paramSplit[0] == "Ei":
-                    Ei = float(paramSplit[1])
-                if paramSplit[0] == "TwoTh":
-                    ## twothBase is the rotation of the entire angular detection system
-                    ## So there are several angles within the CAMEA/MANTA subsystem that 
-                    ## are increased by the constant term twoThBase
-                    twothBase = float(paramSplit[1])
-                if paramSplit[0] == "psi":
-                    sampleAng = float(paramSplit[1])
-                if twothBase != "undefined" and Ei != "undefined" and sampleAng != "undefined":
-                    break
-        ## This is just a catch in case something went wrong defining the parameters, instance
-        ## has not yet occurred but could be useful for future debugging.
-        if twothBase == "undefined" or Ei == "undefined" or sampleAng == "undefined":
-            print(f"Something went wrong defining Ei, Two Theta, and the Sample Angle for File {file}")
-            continue
-        ## There are 8 angular channnels of detectors (controlled by channel and channelNum)
-        ## there are 2 rows of detectors, the bottom row has 7 detectors and the top has 6 detectors
-        ## the 6 on the top row are placed in between the 7, so each has a slightly different twoth
-        for detRow in range(1, 3):
-            if detRow == 1:
-                detNum = 7
-                ## there are the different angles within the bottom row of the tube relative
-                ## to the center of the angular channel
-                detAngList = np.array([-3.33, -2.22, -1.11, 0., 1.11, 2.22, 3.33])
-                ## I think defining detAngList within the for loop is slightly less efficient
-                ## but after tests it hardly seems to matter and it improves readability if its
-                ## in the for loop. Future readers of code feel free to change that.
-            elif detRow == 2:
-                detNum = 6
-                ## these are the different angles relative to the top row of the tube
-                ## relative to the center of the angular channel
-                detAngList = np.array([-2.775, -1.665, -0.555, 0.555, 1.665, 2.775])
-            for channel in range(1, channelNum+1):
-                for det in range(detNum):
-                    try:
-                        ##Opening the data based on the detector
-                        fileOpener = open(f"ReuterStokes{str(detRow)}_{str(det+1)}_{channel}.psd")
-                        fileData = fileOpener.readlines()
-                    except FileNotFoundError:
-                        continue
-                    ## below is the true twotheta of the tube based on the twoThBase
-                    ## each angular channel will be rotated by 7.5 degrees from the past one
-                    ## and each tube will be somewhere in the middle of the 7.5. degree span
-                    ## based on detAngList
-
-                    ## For example, if twoThBase = 12, and we are looking at 5th detector tube 
-                    ## on the bottom row of the third channel, twoTh is calculated as
-                    ## twoth = 12 - 1.11 + 2*7.5 = 25.89 degrees
-                    twoth = twothBase - detAngList[det] + ((channel-1) * 7.5)
-                    ## next thing is creating a matrix of all the relevant parameters that will be needed
-                    ## to calculate Q and E
-                    ## This is the portion I think could be optimized further
-                    fileEvents = np.zeros((5, len(calibration.index)))
-                    fileEvents[0] += Ei
-                    ## the indices are the different Efs used from the calibration
-
-                    fileEvents[1] += np.array(calibration.index)
-                    fileEvents[2] += twoth
-                    fileEvents[3] += sampleAng
-                    ## by the end of this, I have created a 5xN(Ef) matrix where each 
-                    ## row corresponds to a specific parameter
-                    ## The last row to be filled in is the intensity for each Ef
-
-                    ## To do this, I make a list of all events and their corresponding intensities
-                    ## This is similar to the way the calibration() in Calibration.py was run
-                    ## Note that the list resets each new file as each one will have slightly
-                    ## different experimental parameters.
-                    fileyPos= []
-                    fileIntensities = []
-                    for line in fileData[instrument.startpoint():]:
-                        splitLine = line.split()
-                        ## the format of each event in the psd tube format is 
-                        ## Intensity, x, y, z, ....
-                        ## where the ... includes variables we don't care about
-                        ## We need Intensity, and the y position, which is the vertical
-                        ## location where the neutron lands on the detector
-                        intensity = float(splitLine[0])
-                        ## I ignore all 0 and "negative" intensity events (a weird quirk that shows up)
-                        ## occasionally.
-                        if intensity <= 0:
-                            continue
-                        else:
-                            ## Now I keep track of the yposition and the corresponding intensity
-                            ## By appending them to the relevant lists
-                            ypos = float(splitLine[2])
-                            fileyPos.append(ypos)
-                            fileIntensities.append(intensity)
-                    ## Now I histogram the data with the same bins as in the calibration.
-                    ## The positions are passed as the "x" data and they are weighted by the 
-                    ## intensities.
-                    histogrammedData, binEdges = np.histogram(fileyPos, bins = 1024, weights = fileIntensities, range = (-0.45, 0.45))
-                    
-                    ## Now I matrix multiply. Essentially it multiplies an 1024 x N(Ef)
-                    ## matrix by a 1024 column vector, turning it into an N(Ef) column
-                    ## vector that has the intensities for each of the energies.
-                    ## This is based off the prismatic weighting from the calibration.
-                    updatedintensities = np.matmul(calibrationArr, histogrammedData)
-                    ## I then add it to the fileEvents array and then append the final
-                    ## fileEvents array to the events list.
-                    fileEvents[4] += updatedintensities
-                    ## I mentioned before that each row in fileEvents corresponds to a different parameter
-                    ## It was easier to do this for the collection of data, but it will be easier to
-                    ## perform the future calculations of Q using pandas, thus we transpose the matrix
-                    ## to form the following row format: [Ei, Ef, twoth, sampleAng, Intensity]
-                    events.append(fileEvents.transpose())
-        fileOpener.close()                  
-    # Now that we have all the data, let's prepare it for the pandas dataframe                
-    events = np.array(events)
-    ## This step basically flattens the np array so that instead of having several matrices
-    ## with the shape (N(Ef)*5) appended to each other, we get a single matrix with 5 columns
-    ## with all the unique events being a different row
-    events = np.reshape(events, newshape = (len(events)* len(events[0]), 5))
+    loaded = _loadFolders(instrument, calibrationArr, efs, dataPath, filesToRead, scans, selection, workers, pool)
+    if loaded == None:
+        return None
+    # Now that we have all the data, let's prepare it for the pandas dataframe
+    ## The events of every folder are joined once
+    blocks = [block for file, block in loaded if block is not None]
+    if len(blocks) == 0:
+        events = np.zeros((0, 5))
+    else:
+        events = np.concatenate(blocks)
+    if compact == True and incremental == False:
+        data = compactEvents(events, compactType)
+    else:
+        data = eventFrame(events)
+
+    if incremental == True:
+        ## The new manifest starts with the folders that were kept, in the order they are in the store
+        newManifest = {}
+        row = 0
+        for file in sorted(keptFolders, key = lambda file: manifest[file]["start"]):
+            newManifest[file] = {"fingerprint": manifest[file]["fingerprint"], "start": row, "rows": manifest[file]["rows"]}
+            row += manifest[file]["rows"]
+        for file, block in loaded:
+            rows = 0 if block is None else len(block)
+            newManifest[file] = {"fingerprint": fingerprints[file], "start": row, "rows": rows}
+            row += rows
+        extra = {"folder": folder, "calibration": calibrationKey, "manifest": newManifest}
+        ## If every folder in the store was kept, the new events only have to be added to the end
+        if len(manifest) > 0 and len(keptFolders) == len(manifest):
+            appendEvents(data, path, extra)
+        else:
+            ## Otherwise the events of the kept folders are copied over with the new events
+            pieces = []
+            if len(keptFolders) > 0:
+                previous = loadEvents(path)
+                for file in sorted(keptFolders, key = lambda file: manifest[file]["start"]):
+                    pieces.append(previous.iloc[manifest[file]["start"]:manifest[file]["start"] + manifest[file]["rows"]])
+            pieces.append(data)
+            saveEvents(pd.concat(pieces, ignore_index = True), path, instrument, dtype = storeType, extra = extra)
+        if compact == True:
+            return compactFrame(loadEvents(path), compactType)
+        return loadEvents(path)
+    if store != None:
+        saveEvents(data, storePath(instrument, store), instrument, dtype = storeType, extra = {"folder": folder})
+    return data
+
+## eventFrame() turns the [Ei, Ef, twoth, sampleAng, Intensity] events into the pandas dataframe
+## and adds the columns used for plotting.
+def eventFrame(events):
     ## now create the pandas dataframe
-    data = pd.DataFrame(events, columns = ["Ei", "Ef", "Two Theta", "Sample Angle", "Intensity"])
+    with stage("dataframe build") as timer:
+        data = pd.DataFrame(events, columns = ["Ei", "Ef", "Two Theta", "Sample Angle", "Intensity"])
+        timer.eventsEmitted = len(data)
     ## Now create the new columns used in plotting,
-    data["E"] = (data["Ei"] - data["Ef"])
-    data["ki"] = 2*np.pi/np.sqrt(81.8047/data["Ei"])
-    data["kf"] = 2*np.pi/np.sqrt(81.8047/data["Ef"])
-    ## Uses ki, kf, twoTheta, and sampleAng to calculate Qx and Qy
-    ## Qx and Qy are calculated using the functions defined above in the code
-    data["Qx"] = qx_calculator(data["ki"], data["kf"], data["Two Theta"], data["Sample Angle"])
-    data["Qy"] = qy_calculator(data["ki"], data["kf"], data["Two Theta"], data["Sample Angle"])
-    data["Intensity"] = data["Intensity"] * data["ki"]/data["kf"]
+    with stage("Q/E derivation") as timer:
+        data["E"] = (data["Ei"] - data["Ef"])
+        data["ki"] = 2*np.pi/np.sqrt(81.8047/data["Ei"])
+        data["kf"] = 2*np.pi/np.sqrt(81.8047/data["Ef"])
+        ## Uses ki, kf, twoTheta, and sampleAng to calculate Qx and Qy
+        ## Qx and Qy are calculated using the functions defined above in the code
+        data["Qx"] = qx_calculator(data["ki"], data["kf"], data["Two Theta"], data["Sample Angle"])
+        data["Qy"] = qy_calculator(data["ki"], data["kf"], data["Two Theta"], data["Sample Angle"])
+        data["Intensity"] = data["Intensity"] * data["ki"]/data["kf"]
+        timer.eventsEmitted = len(data)
     return data
+
+## dataLoaderChunks() is the streaming version of dataLoader() for datasets that are too large to hold in memory.
+## Instead of returning one dataframe it is a generator that yields dataframes (with E, ki, kf, Qx and Qy already
+## calculated) a piece at a time, so only one piece is in memory at once. By default (chunkSize = None) each
+## piece is one scan point folder; otherwise the events are regrouped into pieces of chunkSize rows (the last one
+## may be smaller). workers, pool and sparse work the same as in dataLoader(); only a few folders are read ahead of the
+## piece being used, so the memory needed does not grow with the size of the dataset.
+## For example, to add up the intensity of every event:
+## for chunk in dataLoaderChunks(instrument, calibration, "dataFolderName"):
+##     total += chunk["Intensity"].sum()
+## histogramChunks() in Analysis.py uses these pieces to histogram a dataset without loading all of it.
+## compact = True yields EventTables instead of dataframes (see dataLoader()). eiRange, psiRange, twothRange, channels
+## and tubes load only part of the data, as in dataLoader().
+def dataLoaderChunks(instrument, calibration, folder, chunkSize = None, workers = None, pool = "process", sparse = False,
+                     compact = False, compactType = np.float32, eiRange = None, psiRange = None, twothRange = None,
+                     channels = None, tubes = None):
+    dataPath = os.path.abspath(os.path.join(instrument.pathBase, folder))
+    with stage("file discovery") as timer:
+        ## The scan index (see ScanIndex.py) is kept in the data folder, but it isn't a scan point folder
+        allFiles = [f for f in os.listdir(dataPath) if not f.startswith(scanIndexFile)]
+        timer.eventsEmitted = len(allFiles)
+    ## The Ei, Two Theta and psi of every folder, from the scan index
+    scans = scanIndex(dataPath)
+    allFiles = _selectFolders(allFiles, scans, eiRange, psiRange)
+    selection = _tubeSelection(channels, tubes, twothRange)
+    if sparse == True:
+        calibrationArr = sparseCalibration(calibration)
+    else:
+        calibrationArr = np.array(calibration)
+    efs = np.array(calibration.index)
+    if _checkPool(pool) == False:
+        return
+    if compact == True:
+        makeChunk = partial(compactEvents, dtype = compactType)
+    else:
+        makeChunk = eventFrame
+    ## pending holds the events that haven't been handed out yet when chunkSize is used
+    pending = []
+    pendingRows = 0
+    for file, block in _iterFolders(instrument, calibrationArr, efs, dataPath, allFiles, scans, selection, workers, pool):
+        if block is None or len(block) == 0:
+            continue
+        if chunkSize == None:
+            yield makeChunk(block)
+            continue
+        pending.append(block)
+        pendingRows += len(block)
+        while pendingRows >= chunkSize:
+            events = np.concatenate(pending)
+            yield makeChunk(events[:chunkSize])
+            pending = [events[chunkSize:]]
+            pendingRows = len(pending[0])
+    if pendingRows > 0:
+        yield makeChunk(np.concatenate(pending))
+
+## _checkPool() makes sure the pool option is one that is understood
+def _checkPool(pool):
+    if pool != "process" and pool != "thread":
+        print("pool not recognized! Please specify as 'process' or 'thread'.")
+        return False
+    return True
+
+## _loadFolders() reads the folders in files (inside dataPath) with folderEvents(), either in this process or
+## spread over workers processes or threads (see dataLoader()). scans are the scan parameters of the folders
+## from scanIndex() and selection are the tubes to read from _tubeSelection(). It returns a list of (folder, events)
+## pairs, where events is None for folders that could not be read.
+def _loadFolders(instrument, calibrationArr, efs, dataPath, files, scans, selection, workers, pool):
+    if _checkPool(pool) == False:
+        return None
+    return list(_iterFolders(instrument, calibrationArr, efs, dataPath, files, scans, selection, workers, pool))
+
+## _selectFolders() keeps the folders in files whose Ei and psi are inside eiRange and psiRange. Folders that
+## aren't in the scan index (e.g. psd_tube1_1a.dat is missing) are kept, so folderEvents() can say what is wrong with them.
+def _selectFolders(files, scans, eiRange, psiRange):
+    if eiRange == None and psiRange == None:
+        return files
+    selected = set(selectScans(scans, eiRange = eiRange, psiRange = psiRange))
+    return [file for file in files if file in selected or scans.get(file) == None]
+
+## _tubeSelection() collects the channels, tubes and twothRange arguments of folderEvents()
+def _tubeSelection(channels, tubes, twothRange):
+    if tubes != None:
+        tubes = [tuple(tube) for tube in tubes]
+    return {"channels": channels, "tubes": tubes, "twothRange": twothRange}
+
+## _iterFolders() is a generator that yields a (folder, events) pair for each folder in files, in the same order
+## as files, while updating the tqdm progress bar. When workers are used only 2 folders per worker are
+## submitted ahead of the one being yielded, so the results that are waiting never take up much memory.
+def _iterFolders(instrument, calibrationArr, efs, dataPath, files, scans, selection, workers, pool):
+    ## Each folder is read with its scan parameters, so psd_tube1_1a.dat doesn't need to be opened again
+    folderArgs = [(os.path.join(dataPath, file), scans.get(file)) for file in files]
+    if workers == None or workers == 1:
+        ## The folders are read one at a time, as the progress bar reaches them
+        results = (folderEvents(instrument, calibrationArr, efs, *args, **selection) for args in folderArgs)
+        yield from _progressBlocks(results, files)
+        return
+    if pool == "thread":
+        executor = ThreadPoolExecutor(max_workers = workers)
+        task = partial(folderEvents, instrument, calibrationArr, efs, **selection)
+    else:
+        ## Each process is sent the instrument, the calibration and the tubes to read once when it starts
+        ## (by _initWorker()) rather than with every folder
+        executor = ProcessPoolExecutor(max_workers = workers, initializer = _initWorker,
+                                       initargs = (instrument, calibrationArr, efs, selection))
+        task = _workerFolderEvents
+    if profilingEnabled() and pool == "process":
+        ## The stages of each folder are sent back from the worker with its events (see Profiling.py)
+        results = collectProfiles(_boundedMap(executor, partial(profiledCall, task), folderArgs, 2*workers))
+    else:
+        results = _boundedMap(executor, task, folderArgs, 2*workers)
+    try:
+        yield from _progressBlocks(results, files)
+    finally:
+        executor.shutdown(wait = True, cancel_futures = True)
+
+## _boundedMap() works like executor.map(), keeping at most window tasks submitted at once.
+## Each item is a tuple of the arguments of task.
+def _boundedMap(executor, task, items, window):
+    submitted = deque()
+    for item in items:
+        submitted.append(executor.submit(task, *item))
+        if len(submitted) >= window:
+            yield submitted.popleft().result()
+    while len(submitted) > 0:
+        yield submitted.popleft().result()
+
+## _workerArgs holds the instrument, calibration array, and Efs in each worker process, and _workerSelection the tubes to read
+_workerArgs = None
+_workerSelection = None
+def _initWorker(instrument, calibrationArr, efs, selection):
+    global _workerArgs, _workerSelection
+    _workerArgs = (instrument, calibrationArr, efs)
+    _workerSelection = selection
+def _workerFolderEvents(folderPath, params):
+    return folderEvents(*_workerArgs, folderPath, params, **_workerSelection)
+
+## _progressBlocks() takes the results of folderEvents() for each folder and pairs them with the folder names
+## while updating the tqdm progress bar.
+def _progressBlocks(results, allFiles):
+    ## This section sets up the tqdm progress bar (a convenience)
+    ## So users can track how long their data will take to load
+    progress = tqdm(allFiles)
+    progress.set_description("FilesRead/TotalFiles")
+    for file in progress:
+        yield file, next(results)
+    progress.close()
@@ -0,0 +1,116 @@
+## The DesignSweep module compares instrument designs in one go. Normally every design (number of stations,
+## mosaic and toy model or full instrument) is set up by hand: Instrument(), calibration(), dataLoader() and
+## resolution() are called for each one and the results are collected for resolutionComp() in Plotting.py.
+## runDesignSweep() does all of this for a list of designs, with every design running in its own process,
+## and writes the results of all the designs into one table:
+##   designs = designGrid([5, 8, 10], [30, 60, 120], ["toy model"], "/sims/{type}_{stations}_{mosaic}", "calibration", "data")
+##   results = runDesignSweep(designs, {"xVar": "Qx", "xStepSize": 0.05, "resVar": "E", "binSize": 0.01,
+##                                      "integrationVar": "Qy", "integrationVal": 0, "integrationWidth": 0.05})
+## The calibration of each design is cached (see Cache.py) and its events are kept in an incremental store
+## (see EventStore.py), so running the sweep again only refits or reloads the designs whose files changed.
+## As with dataLoader(), on Windows the call needs to be inside an if __name__ == "__main__": block when running from a script.
+
+##Here are the necessary import statements for this file
+import numpy as np
+import pandas as pd
+import os
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from Instrument_Creator import Instrument
+from Calibration import calibration
+from DataLoader import dataLoader
+from Analysis import resolutionData
+
+## The columns of the table made by runDesignSweep()
+resultColumns = ["type", "stations", "mosaic", "pathBase", "xVar", "resVar", "x", "fwhm", "status"]
+
+## designGrid() makes a design for every combination of stationsList, mosaicList and types.
+## pathBase is the folder of the simulations of a design. It can contain {stations}, {mosaic} and {type},
+## which are filled in for each design, since every design normally has its own simulations.
+## calibrationFolder and dataFolder are the folders (inside pathBase) passed to calibration() and dataLoader().
+def designGrid(stationsList, mosaicList, types, pathBase, calibrationFolder, dataFolder):
+    designs = []
+    for designType, stations, mosaic in itertools.product(types, stationsList, mosaicList):
+        design = {"stations": stations, "mosaic": mosaic, "type": designType}
+        design["pathBase"] = pathBase.format(**design)
+        design["calibration"] = calibrationFolder
+        design["data"] = dataFolder
+        designs.append(design)
+    return designs
+
+## runDesignSweep() runs calibration -> dataLoader -> resolution for every design in designs (a list of dicts
+## like the ones from designGrid()) and returns a dataframe with a row for each point of each resolution curve.
+## resolutionArgs is a dict with the arguments of resolution() (xVar, xStepSize, resVar, binSize, integrationVar,
+## integrationVal, integrationWidth and optionally threshold, binRange, xlim, method and refine).
+## loadArgs (optional) is a dict of extra arguments for dataLoader(), such as {"sparse": True}.
+## workers is the number of designs that run at the same time, by default one for every core (os.cpu_count()).
+## Each design runs in a single process, so the calibration and loading inside a design are not split up further.
+## The "status" column is "ok" for a fitted point, "failed" or "multiple peaks" for the points resolution() would
+## leave out (with an empty fwhm), and starts with "error" if the design could not be run at all.
+## The table is also written to output (a .csv file inside the current folder unless a full path is given),
+## set output = None to only return it.
+def runDesignSweep(designs, resolutionArgs, workers = None, output = "designSweep.csv", loadArgs = None,
+                   cacheDir = None, fingerprint = "mtime"):
+    if workers == None:
+        workers = os.cpu_count()
+    if loadArgs == None:
+        loadArgs = {}
+    tasks = [(design, resolutionArgs, loadArgs, cacheDir, fingerprint) for design in designs]
+    if workers == 1 or len(designs) <= 1:
+        rowLists = list(map(_runDesign, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers = min(workers, len(designs))) as executor:
+            ## map() keeps the results in the order of designs
+            rowLists = list(executor.map(_runDesign, tasks))
+    rows = [row for rowList in rowLists for row in rowList]
+    for row in rows:
+        if row["status"].startswith("error"):
+            print(f"Design {row['type']} {row['stations']} Stations Mosaic {row['mosaic']} failed: {row['status']}")
+    results = pd.DataFrame(rows, columns = resultColumns)
+    if output != None:
+        results.to_csv(output, index = False)
+        print(f"Design sweep saved to {output}")
+    return results
+
+## designStore() is the name of the event store of a design, so designs sharing a pathBase don't share a store
+def designStore(design):
+    return f"events_{design['type'].replace(' ', '_')}_{design['stations']}_{design['mosaic']}_{design['data']}"
+
+## _runDesign() runs a single design and returns its rows of the table. Anything that goes wrong is
+## turned into a single "error" row, so one broken design doesn't stop the rest of the sweep.
+def _runDesign(task):
+    design, resolutionArgs, loadArgs, cacheDir, fingerprint = task
+    base = {"type": design["type"], "stations": design["stations"], "mosaic": design["mosaic"],
+            "pathBase": design["pathBase"], "xVar": resolutionArgs.get("xVar"), "resVar": resolutionArgs.get("resVar")}
+    try:
+        instrument = Instrument(design["stations"], design["mosaic"], design["pathBase"], design["type"])
+        calibrationDF = calibration(instrument, design["calibration"], cache = True, cacheDir = cacheDir,
+                                    fingerprint = fingerprint)
+        data = dataLoader(instrument, calibrationDF, design["data"], store = design.get("store", designStore(design)),
+                          incremental = True, **loadArgs)
+        if data is None:
+            return [dict(base, x = np.nan, fwhm = np.nan, status = "error: no data was loaded")]
+        result = resolutionData(data, **resolutionArgs)
+        if result == None:
+            return [dict(base, x = np.nan, fwhm = np.nan, status = "error: wrong resolution variables")]
+    except Exception as error:
+        return [dict(base, x = np.nan, fwhm = np.nan, status = f"error: {error!r}")]
+    rows = [dict(base, x = x, fwhm = fwhm, status = "ok") for x, fwhm in zip(result["x"], result["fwhm"])]
+    rows += [dict(base, x = x, fwhm = np.nan, status = "failed") for x in result["failed"]]
+    rows += [dict(base, x = x, fwhm = np.nan, status = "multiple peaks") for x in result["multiplePeaks"]]
+    return sorted(rows, key = lambda row: row["x"])
+
+## resolutionCompInputs() turns the table from runDesignSweep() (or the .csv file it wrote) into the instrumentList
+## and resxy arguments of resolutionComp() in Plotting.py, using only the fitted points:
+##   instrumentList, resxy = resolutionCompInputs("designSweep.csv")
+##   resolutionComp(instrumentList, resxy, "Qx", "E")
+def resolutionCompInputs(results):
+    if isinstance(results, str):
+        results = pd.read_csv(results)
+    results = results[results["status"] == "ok"]
+    instrumentList = []
+    resxy = []
+    for (designType, stations, mosaic, pathBase), design in results.groupby(["type", "stations", "mosaic", "pathBase"], sort = False):
+        instrumentList.append(Instrument(int(stations), int(mosaic), pathBase, designType))
+        resxy.append([list(design["x"]), list(design["fwhm"])])
+    return instrumentList, resxy
@@ -0,0 +1,113 @@
+## The EventIndex module speeds up the integration volumes used by the functions in Plotting.py.
+## Every cut selects the events inside a box such as integrationVal - integrationWidth < E < integrationVal + integrationWidth,
+## which normally means comparing every event in the dataframe, and resolution() and cut2DError() do this for every
+## point of their sweep. An EventIndex is built once per dataset: it divides (Qx, Qy, E) into a regular grid of
+## buckets and reorders the events so the events of each bucket are next to each other. A box then only has to
+## look at the events in the buckets it overlaps.
+## An EventIndex can be passed to cut2D(), cut1D(), resolution() and cut2DError() in place of the dataframe:
+##   dataIndex = EventIndex(mantaData)
+##   resolution(instrument, dataIndex, "Qx", 0.05, "E", 0.01, "Qy", 0, 0.05)
+## It works with the dataframe from dataLoader() or with an EventTable (see EventTable.py).
+
+##Here are the necessary import statements for this file
+import numpy as np
+import pandas as pd
+
+class EventIndex:
+    ## data is the dataframe (or EventTable) of events. variables are the columns the grid is made over,
+    ## and bins is the number of buckets along each of them, either one number for all of them or a list.
+    ## The default of 64 buckets per variable gives a few hundred events per bucket for 10^8 events.
+    def __init__(self, data, variables = ("Qx", "Qy", "E"), bins = 64):
+        self.variables = list(variables)
+        if np.ndim(bins) == 0:
+            bins = [bins] * len(self.variables)
+        self.bins = [int(binNum) for binNum in bins]
+        ## The grid covers the range of each variable
+        self.starts = []
+        self.widths = []
+        buckets = []
+        for variable, binNum in zip(self.variables, self.bins):
+            values = np.asarray(data[variable])
+            if len(values) == 0:
+                start, width = 0., 1.
+            else:
+                start = float(values.min())
+                width = (float(values.max()) - start)/binNum
+                if width == 0:
+                    width = 1.
+            self.starts.append(start)
+            self.widths.append(width)
+            buckets.append(self._bucket(values, len(self.starts) - 1))
+        flatBuckets = np.ravel_multi_index(buckets, self.bins)
+        ## The events are sorted by bucket, and offsets[b]:offsets[b+1] are the rows of bucket b
+        order = np.argsort(flatBuckets, kind = "stable")
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(flatBuckets, minlength = int(np.prod(self.bins))))])
+        self.data = takeRows(data, order)
+        self._values = {variable: np.asarray(self.data[variable]) for variable in self.variables}
+
+    ## _bucket() gives the bucket along variable number axis for each value. The same formula is used for the
+    ## events and for the edges of a box, so an event inside a box is always inside the buckets of the box.
+    def _bucket(self, values, axis):
+        buckets = np.floor((np.asarray(values, dtype = np.float64) - self.starts[axis])/self.widths[axis])
+        return np.clip(buckets, 0, self.bins[axis] - 1).astype(np.int64)
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def columns(self):
+        return self.data.columns
+
+    ## A column name gives the column (in the order of the index), like the dataframe
+    def __getitem__(self, column):
+        return self.data[column]
+
+    ## query() returns the events inside the integration volumes in windows, which is a dict
+    ## {integrationVar: (integrationVal, integrationWidth), ...} like histogramChunks() in Analysis.py
+    ## (or a list of (integrationVar, (integrationVal, integrationWidth)) pairs). Only the events with
+    ## integrationVal - integrationWidth < integrationVar < integrationVal + integrationWidth are kept, exactly as
+    ## in cut2D() and cut1D(). Variables that are not part of the grid can be used as well, they are just compared
+    ## for the events in the buckets of the box. The result is the same kind of object the index was built from.
+    def query(self, windows):
+        if isinstance(windows, dict):
+            windows = list(windows.items())
+        firstBuckets = [0] * len(self.variables)
+        lastBuckets = [binNum - 1 for binNum in self.bins]
+        for integrationVar, (integrationVal, integrationWidth) in windows:
+            if integrationVar not in self.variables:
+                continue
+            axis = self.variables.index(integrationVar)
+            values = self._values[integrationVar]
+            ## The edges are rounded to the type of the column first, since that is how they are compared below
+            low = values.dtype.type(integrationVal - integrationWidth)
+            high = values.dtype.type(integrationVal + integrationWidth)
+            firstBuckets[axis] = max(firstBuckets[axis], int(self._bucket(low, axis)))
+            lastBuckets[axis] = min(lastBuckets[axis], int(self._bucket(high, axis)))
+        if any(first > last for first, last in zip(firstBuckets, lastBuckets)):
+            return takeRows(self.data, np.zeros(0, dtype = np.int64))
+        ## The buckets of the last variable are next to each other, so for each combination of buckets of the
+        ## other variables the rows of the box are a single range
+        leading = np.meshgrid(*[np.arange(first, last + 1) for first, last in zip(firstBuckets[:-1], lastBuckets[:-1])],
+                              indexing = "ij")
+        leading = [grid.ravel() for grid in leading]
+        rangeNum = len(leading[0]) if len(leading) > 0 else 1
+        startBuckets = np.ravel_multi_index(leading + [np.full(rangeNum, firstBuckets[-1])], self.bins)
+        starts = self.offsets[startBuckets]
+        ends = self.offsets[startBuckets + lastBuckets[-1] - firstBuckets[-1] + 1]
+        lengths = ends - starts
+        rows = np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        ## Finally the events in the buckets on the edge of the box are compared exactly
+        mask = np.ones(len(rows), dtype = bool)
+        for integrationVar, (integrationVal, integrationWidth) in windows:
+            if integrationVar in self._values:
+                values = self._values[integrationVar][rows]
+            else:
+                values = np.asarray(self.data[integrationVar])[rows]
+            mask &= (values > integrationVal - integrationWidth) & (values < integrationVal + integrationWidth)
+        return takeRows(self.data, rows[mask])
+
+## takeRows() picks rows (by position) out of a dataframe or an EventTable
+def takeRows(data, rows):
+    if isinstance(data, pd.DataFrame):
+        return data.iloc[rows]
+    return data[rows]
@@ -0,0 +1,142 @@
+## The EventStore module saves the dataframe from dataLoader() to disk in a binary, column by column
+## format, so that a dataset can be opened again without re-reading every ReuterStokes .psd file.
+## A store is a folder with one .npy file per column and a metadata.json header that records the
+## columns, their types, the number of events, and the instrument the data was taken with.
+## The .npy files are memory-mapped when the store is loaded, so opening a store only reads the
+## header; the events themselves are read from disk as they are used.
+## (A folder of .npy files is used rather than Parquet or .npz because numpy can memory-map .npy
+## files directly and it does not need any library beyond numpy.)
+
+##Here are the necessary import statements for this file
+import numpy as np
+import pandas as pd
+import os
+import json
+import io
+import shutil
+from datetime import datetime as dt
+
+## storeVersion is written in the header, in case the layout of a store ever changes
+storeVersion = 1
+
+## storePath() decides where a store is located. Like the figures saved by the plotting functions,
+## a store given by name only is put in the instrument's pathBase. Absolute paths are kept as they are.
+def storePath(instrument, store):
+    return os.path.join(instrument.pathBase, store)
+
+## saveEvents() writes the dataframe as a store at path.
+## dtype controls the type the columns are saved as. By default each column keeps its type (float64 for
+## dataLoader()), but dtype = np.float32 halves the size on disk. A dict such as {"Intensity": np.float64}
+## can be given to choose the type of single columns, any column not in the dict keeps its type.
+## The instrument (optional) is saved in the header so it is known what design the data belongs to.
+## extra (optional) is a dict of anything else that should be kept in the header.
+def saveEvents(data, path, instrument = None, dtype = None, extra = None):
+    columns = []
+    ## The store is written in a temporary folder first and then moved, so an interrupted save
+    ## never leaves a half written store behind
+    tempPath = path + ".tmp"
+    if os.path.exists(tempPath):
+        shutil.rmtree(tempPath)
+    os.makedirs(tempPath)
+    for index, column in enumerate(data.columns):
+        if isinstance(dtype, dict):
+            columnType = dtype.get(column, data[column].dtype)
+        elif dtype != None:
+            columnType = dtype
+        else:
+            columnType = data[column].dtype
+        ## np.asarray() works for the columns of a dataframe and of an EventTable (see EventTable.py)
+        values = np.ascontiguousarray(np.asarray(data[column]), dtype = columnType)
+        ## Column names like "Two Theta" have spaces, so the files are just numbered
+        fileName = f"column{index}.npy"
+        np.save(os.path.join(tempPath, fileName), values)
+        columns.append({"name": column, "file": fileName, "dtype": str(values.dtype)})
+    metadata = {"version": storeVersion, "rows": len(data), "columns": columns,
+                "created": dt.now().strftime('%Y_%m_%d_%H_%M_%S')}
+    if instrument != None:
+        metadata["instrument"] = {"stations": instrument.stations, "mosaic": instrument.mosaic,
+                                  "type": instrument.type, "pathBase": instrument.pathBase}
+    if extra != None:
+        metadata.update(extra)
+    with open(os.path.join(tempPath, "metadata.json"), "w") as fileOpener:
+        json.dump(metadata, fileOpener, indent = 1)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tempPath, path)
+
+## storeMetadata() reads only the header of a store
+def storeMetadata(path):
+    with open(os.path.join(path, "metadata.json"), "r") as fileOpener:
+        return json.load(fileOpener)
+
+## loadEvents() opens a store written by saveEvents() and returns the same dataframe.
+## With mmap = True (the default) the columns are memory-mapped, so nothing is copied into memory
+## until it is needed. Note that the memory-mapped columns are read only; operations that create new
+## dataframes (like the cuts in Plotting.py) work as normal. Set mmap = False to read everything into memory.
+## columns (optional) is a list of the columns to load, by default every column is loaded.
+## The header is kept in data.attrs["metadata"].
+def loadEvents(path, mmap = True, columns = None):
+    metadata = storeMetadata(path)
+    arrays = {}
+    for column in metadata["columns"]:
+        if columns != None and column["name"] not in columns:
+            continue
+        if mmap == True:
+            values = np.load(os.path.join(path, column["file"]), mmap_mode = "r")
+        else:
+            values = np.load(os.path.join(path, column["file"]))
+        ## Only the number of rows recorded in metadata.json is used (see appendEvents())
+        arrays[column["name"]] = values[:metadata["rows"]]
+    ## copy = False keeps the memory-mapped arrays as the columns of the dataframe
+    data = pd.DataFrame(arrays, copy = False)
+    data.attrs["metadata"] = metadata
+    return data
+
+## appendEvents() adds the events of data to the end of an existing store without rewriting it, which is
+## what lets dataLoader(incremental = True) take only as long as the new data takes to read.
+## The columns of data must be the same as the columns of the store; they are converted to the type
+## already used in the store. extra (optional) is a dict of header entries to update.
+def appendEvents(data, path, extra = None):
+    metadata = storeMetadata(path)
+    if [column["name"] for column in metadata["columns"]] != list(data.columns):
+        raise ValueError(f"The columns of the data do not match the columns of the store {path}")
+    rows = metadata["rows"]
+    for column in metadata["columns"]:
+        values = np.ascontiguousarray(data[column["name"]].to_numpy(), dtype = column["dtype"])
+        filePath = os.path.join(path, column["file"])
+        with open(filePath, "r+b") as fileOpener:
+            ## The .npy header says the shape of the array. numpy leaves spare room in the header so the
+            ## length can grow, so only the header is rewritten and the new events are written at the end.
+            version = np.lib.format.read_magic(fileOpener)
+            if version == (1, 0):
+                np.lib.format.read_array_header_1_0(fileOpener)
+            else:
+                np.lib.format.read_array_header_2_0(fileOpener)
+            headerEnd = fileOpener.tell()
+            header = io.BytesIO()
+            headerDict = {"descr": np.lib.format.dtype_to_descr(values.dtype), "fortran_order": False,
+                          "shape": (rows + len(values),)}
+            if version == (1, 0):
+                np.lib.format.write_array_header_1_0(header, headerDict)
+            else:
+                np.lib.format.write_array_header_2_0(header, headerDict)
+            if len(header.getvalue()) == headerEnd:
+                ## The number of rows in metadata.json is used rather than the end of the file, so anything
+                ## left over from an append that was interrupted is overwritten
+                fileOpener.seek(headerEnd + rows * values.dtype.itemsize)
+                fileOpener.truncate()
+                fileOpener.write(values.tobytes())
+                fileOpener.seek(0)
+                fileOpener.write(header.getvalue())
+                continue
+        ## If the header can't be rewritten in place, the column is written again
+        oldValues = np.load(filePath)[:rows]
+        np.save(filePath, np.concatenate([oldValues, values]))
+    ## metadata.json is written last, so the store only changes size once every column is written
+    metadata["rows"] = rows + len(data)
+    if extra != None:
+        metadata.update(extra)
+    tempPath = os.path.join(path, "metadata.json.tmp")
+    with open(tempPath, "w") as fileOpener:
+        json.dump(metadata, fileOpener, indent = 1)
+    os.replace(tempPath, os.path.join(path, "metadata.json"))
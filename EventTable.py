@@ -0,0 +1,118 @@
+## The EventTable module holds a compact alternative to the pandas dataframe made by dataLoader().
+## The dataframe keeps 10 float64 columns (Ei, Ef, Two Theta, Sample Angle, Intensity, E, ki, kf, Qx, Qy),
+## but E, ki, kf, Qx and Qy can all be calculated from Ei, Ef, Two Theta and Sample Angle.
+## An EventTable only stores those four columns and the intensity, optionally as float32, and calculates
+## E, ki, kf, Qx and Qy the first time they are used. Once calculated they are remembered.
+## It supports the parts of the dataframe that Plotting.py uses, so it can be passed to the plotting
+## functions in place of the dataframe:
+##   table["Qx"]                            gives the column as a numpy array
+##   table[table["E"] > 1.]                 gives a new EventTable with only the events that match
+##   table.sort_values(by = "Intensity")    gives a new EventTable sorted by a column
+## toDataFrame() turns it back into the usual dataframe if anything else is needed.
+
+##Here are the necessary import statements for this file
+import numpy as np
+import pandas as pd
+from Profiling import stage
+
+class EventTable:
+    ## The columns that are stored, and the columns that are calculated from them
+    primitiveColumns = ["Ei", "Ef", "Two Theta", "Sample Angle", "Intensity"]
+    derivedColumns = ["E", "ki", "kf", "Qx", "Qy"]
+
+    ## primitives is a dict with a numpy array for each of the primitiveColumns, where the Intensity
+    ## is already scaled by ki/kf like in dataLoader(). derived (optional) is a dict of derived columns
+    ## that have already been calculated.
+    def __init__(self, primitives, derived = None):
+        self._primitives = primitives
+        if derived == None:
+            derived = {}
+        self._derived = derived
+
+    def __len__(self):
+        return len(self._primitives["Intensity"])
+
+    @property
+    def columns(self):
+        return self.primitiveColumns + self.derivedColumns
+
+    @property
+    def shape(self):
+        return (len(self), len(self.columns))
+
+    def __contains__(self, column):
+        return column in self.columns
+
+    ## A column name gives the column, anything else (a True/False mask, or an array of row numbers)
+    ## gives a new EventTable with just those rows. Derived columns that were already calculated are
+    ## carried over so they don't need to be calculated again.
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            if key in self._primitives:
+                return self._primitives[key]
+            if key not in self.derivedColumns:
+                raise KeyError(key)
+            if key not in self._derived:
+                self._derived[key] = self._derive(key)
+            return self._derived[key]
+        rows = np.asarray(key)
+        return EventTable({column: values[rows] for column, values in self._primitives.items()},
+                          {column: values[rows] for column, values in self._derived.items()})
+
+    ## _derive() calculates a derived column, using the same formulas as dataLoader()
+    def _derive(self, column):
+        ## qx_calculator and qy_calculator are imported here, because DataLoader.py imports this module
+        from DataLoader import qx_calculator, qy_calculator
+        ## Qx and Qy need ki and kf, which are derived (and timed) on their own first
+        if column == "Qx" or column == "Qy":
+            ki, kf = self["ki"], self["kf"]
+        with stage("Q/E derivation") as timer:
+            timer.eventsEmitted = len(self)
+            if column == "E":
+                return self["Ei"] - self["Ef"]
+            elif column == "ki":
+                return 2*np.pi/np.sqrt(81.8047/self["Ei"])
+            elif column == "kf":
+                return 2*np.pi/np.sqrt(81.8047/self["Ef"])
+            elif column == "Qx":
+                return qx_calculator(ki, kf, self["Two Theta"], self["Sample Angle"])
+            elif column == "Qy":
+                return qy_calculator(ki, kf, self["Two Theta"], self["Sample Angle"])
+
+    ## sort_values() has the same name as the pandas function so cut2D() can use it
+    def sort_values(self, by, ascending = True):
+        order = np.argsort(self[by], kind = "stable")
+        if ascending == False:
+            order = order[::-1]
+        return self[order]
+
+    def head(self, n = 5):
+        return self[np.arange(min(n, len(self)))]
+
+    ## memoryUsage() gives the number of bytes used by the stored and the already calculated columns
+    def memoryUsage(self):
+        return sum(values.nbytes for values in self._primitives.values()) + \
+            sum(values.nbytes for values in self._derived.values())
+
+    ## toDataFrame() gives the usual dataframe, with every column (derived columns are calculated if needed)
+    def toDataFrame(self):
+        return pd.DataFrame({column: self[column] for column in self.columns})
+
+    def __repr__(self):
+        return f"EventTable with {len(self)} events\n{self.head().toDataFrame()}"
+
+## compactEvents() makes an EventTable from the [Ei, Ef, twoth, sampleAng, Intensity] events of dataLoader(),
+## where the intensity has not been scaled by ki/kf yet. dtype is the type the columns are kept as.
+def compactEvents(events, dtype = np.float32):
+    with stage("dataframe build") as timer:
+        ki = 2*np.pi/np.sqrt(81.8047/events[:, 0])
+        kf = 2*np.pi/np.sqrt(81.8047/events[:, 1])
+        primitives = {"Ei": events[:, 0], "Ef": events[:, 1], "Two Theta": events[:, 2],
+                      "Sample Angle": events[:, 3], "Intensity": events[:, 4] * ki/kf}
+        timer.eventsEmitted = len(events)
+        return EventTable({column: np.ascontiguousarray(values, dtype = dtype) for column, values in primitives.items()})
+
+## compactFrame() makes an EventTable from a dataframe made by dataLoader() (or loaded with loadEvents())
+def compactFrame(data, dtype = np.float32):
+    return EventTable({column: np.ascontiguousarray(data[column].to_numpy(), dtype = dtype)
+                       for column in EventTable.primitiveColumns})
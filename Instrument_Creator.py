@@ -152,6 +152,27 @@ class Instrument:
             (0.62-0.45, 0.67-0.45), (0.705-0.45, 0.76-0.45),
                 (0.78-0.45, 0.835-0.45)]
         return baffleRegions
+    ## pixelCenters() returns the centers of the detector pixels.
+    ## there are 1024 pixels used in the 0.9 meter active length ReuterStokes detector (based off CAMEA paper)
+    ## thus 1025 pixel edges are defined. The center of the bin is then defined based on
+    ## the pixelEdges and the halfway point between the edges.
+    def pixelCenters(self):
+        pixelEdges = np.linspace(-0.45, 0.45, 1025)
+        return pixelEdges[:-1] + (pixelEdges[1]-pixelEdges[0])/2
+    ## baffleMask() turns the baffleRegions into a True/False value for each of the 1024 pixels, where True
+    ## means the pixel center is inside a baffle region. The calibration uses it to zero every baffle pixel in
+    ## one step. The mask is only calculated once per design; it is remembered along with the stations and
+    ## mosaic it was made for, so changing either of them afterwards still gives the right mask.
+    def baffleMask(self):
+        design = (self.stations, self.mosaic)
+        if getattr(self, "_baffleMaskDesign", None) != design:
+            pixels = self.pixelCenters()
+            regions = np.array(self.baffleRegions())
+            ## pixels[:, None] compares every pixel with every region at once
+            insideRegion = (pixels[:, None] > regions[:, 0]) & (pixels[:, None] < regions[:, 1])
+            self._baffleMask = insideRegion.any(axis = 1)
+            self._baffleMaskDesign = design
+        return self._baffleMask
     ## The startpoint is a minutia detail that essentially says when in McStas Reuter_Stokes_.psd 
     ## data files (used in Calibration.py and DataLoader.py) the data entries begin. It changes based 
     ## on how you write the McStas file. 
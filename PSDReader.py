@@ -0,0 +1,236 @@
+## The PSDReader module is a small helper shared by Calibration.py and DataLoader.py.
+## Both of them need to read the McStas ReuterStokes{row}_{det}_{channel}.psd event files,
+## which used to be done one line at a time with line.split() and float(). Here the file is
+## memory-mapped and handed to pandas' C parser, which parses it a block of chunkRows events at a time,
+## and the intensity cut is done with numpy masks. pandas still copies the text it parses out of the
+## mapped file (through mmap.read()), a buffer at a time, so the mapping doesn't save that copy; it lets the
+## pages that have been parsed be handed back to the system (see iterPSD()).
+## histogramPSD() adds up the histogram of each block, so the memory it needs stays the same
+## however large the file is.
+## For large production runs the events of a tube can also be kept in a binary file next to (or instead of)
+## the .psd file, with the same name and one of the extensions in binaryFormats, which is used if it is there
+## (and isn't older than the .psd file):
+##   ReuterStokes1_4_2.npy         a (events x 2) float array with the intensity and the y position of each event,
+##                                 as written by convertEvents(), which is memory-mapped and read a block at a time
+##   ReuterStokes1_4_2.npz         the arrays "p" (the intensity) and "y" (the y position)
+##   ReuterStokes1_4_2.mcpl(.gz)   an MCPL file, written by an MCPL_output component placed at the tube so the
+##                                 y position is along the tube. The weight is the intensity. It needs the
+##                                 mcpl package (pip install mcpl).
+## Nothing is parsed from text for these files, and the rest of the pipeline (histogram -> calibration -> Q and E)
+## is unchanged, so calibration() and dataLoader() use them without any change.
+
+##Here are the necessary import statements for this file
+import numpy as np
+import pandas as pd
+import os
+import mmap
+from Profiling import stage
+
+## There are 1024 pixels used in the 0.9 meter active length ReuterStokes detector (based off CAMEA paper)
+## These are the same bins used in Calibration.py and DataLoader.py
+pixelNum = 1024
+detectorRange = (-0.45, 0.45)
+## The number of events parsed at a time. 2**20 events keep each block to a few tens of MB. The histogram of
+## the blocks is equal to np.histogram() of the whole file up to floating-point summation order
+chunkRows = 2**20
+## The binary event files that are used in place of a .psd file, in the order they are looked for
+binaryFormats = [".npy", ".npz", ".mcpl", ".mcpl.gz"]
+
+## findStartpoint() is the automatic version of Instrument.startpoint(). It reads the header of the file
+## until it reaches the first line that begins with a number, which is where the events begin.
+## This is useful if you've written your own McStas file and don't know the length of the header.
+def findStartpoint(filePath):
+    index = 0
+    with open(filePath, "r") as fileOpener:
+        for index, line in enumerate(fileOpener):
+            splitLine = line.split()
+            if len(splitLine) == 0:
+                continue
+            try:
+                float(splitLine[0])
+                return index
+            except ValueError:
+                continue
+    ## If no events were found, the whole file is header
+    return index + 1
+
+## iterPSD() goes through the events of the file a block at a time, and yields the y position (vertical location
+## where the neutron lands on the detector) and the intensity of the events with a positive intensity in each block.
+## startpoint is the number of header lines, normally instrument.startpoint(). If it is not
+## given, the header is detected with findStartpoint().
+def iterPSD(filePath, startpoint = None, chunkRows = chunkRows):
+    if startpoint == None:
+        startpoint = findStartpoint(filePath)
+    with open(filePath, "rb") as fileOpener:
+        ## An empty file can't be memory-mapped, and has no events anyway
+        if os.fstat(fileOpener.fileno()).st_size == 0:
+            return
+        with mmap.mmap(fileOpener.fileno(), 0, access = mmap.ACCESS_READ) as mappedFile:
+            ## the format of each event in the psd tube format is
+            ## Intensity, x, y, z, ....
+            ## so only columns 0 and 2 are parsed. Any stray "#" lines left after the header are skipped
+            with stage(".psd parsing") as timer:
+                timer.readFile(filePath)
+                try:
+                    reader = pd.read_csv(mappedFile, sep=r"\s+", header=None, skiprows=startpoint, usecols=[0, 2],
+                                         comment="#", dtype=np.float64, engine="c", chunksize=chunkRows)
+                except pd.errors.EmptyDataError:
+                    ## ReuterStokes files with a header and no events happen when no neutron reached the tube
+                    return
+            with reader:
+                while True:
+                    with stage(".psd parsing") as timer:
+                        ## The file was already counted once when it was opened
+                        timer.calls = 0
+                        try:
+                            columns = next(reader).to_numpy()
+                        except (StopIteration, pd.errors.EmptyDataError):
+                            break
+                        intensities = columns[:, 0]
+                        yPos = columns[:, 1]
+                        ## I ignore all 0 and "negative" intensity events (a weird quirk that shows up occasionally)
+                        mask = intensities > 0
+                        timer.eventsParsed = len(mask)
+                        yPos, intensities = yPos[mask], intensities[mask]
+                        timer.eventsEmitted = len(yPos)
+                        ## The pages of the file that have been parsed are handed back to the system, so
+                        ## the mapped file doesn't add up in memory either
+                        if hasattr(mmap, "MADV_DONTNEED"):
+                            mappedFile.madvise(mmap.MADV_DONTNEED, 0, mappedFile.tell() - mappedFile.tell() % mmap.PAGESIZE)
+                    yield yPos, intensities
+
+## eventFilePath() gives the file the events of the .psd file at filePath are read from: a binary file with the same
+## name (see binaryFormats) if there is one, otherwise the .psd file itself. A binary file older than the .psd file
+## is out of date (the .psd file was simulated again after it was converted), so the .psd file is read instead.
+def eventFilePath(filePath):
+    stem, extension = os.path.splitext(filePath)
+    if extension == ".psd":
+        for binaryFormat in binaryFormats:
+            try:
+                binaryTime = os.path.getmtime(stem + binaryFormat)
+            except OSError:
+                continue
+            try:
+                psdTime = os.path.getmtime(filePath)
+            except OSError:
+                ## The .psd file was removed after converting it, so the binary file is all there is
+                return stem + binaryFormat
+            if binaryTime >= psdTime:
+                return stem + binaryFormat
+            print(f"{os.path.basename(stem + binaryFormat)} is older than {os.path.basename(filePath)}, reading the .psd file instead!")
+            return filePath
+    return filePath
+
+## iterEvents() works like iterPSD() for the .psd file at filePath, but reads the binary file of the
+## tube instead if there is one (see eventFilePath()). startpoint is only used for .psd files.
+## A FileNotFoundError is raised if there is no file for the tube at all, like for a missing .psd file.
+def iterEvents(filePath, startpoint = None, chunkRows = chunkRows):
+    eventPath = eventFilePath(filePath)
+    if eventPath.endswith(".npy"):
+        events = np.load(eventPath, mmap_mode = "r")
+        for start in range(0, len(events), chunkRows):
+            with stage("binary events") as timer:
+                block = np.array(events[start:start + chunkRows])
+                timer.bytesRead = block.nbytes
+                yPos, intensities = _positiveEvents(block[:, 1], block[:, 0], timer)
+            yield yPos, intensities
+    elif eventPath.endswith(".npz"):
+        with stage("binary events") as timer:
+            timer.readFile(eventPath)
+            with np.load(eventPath) as eventFile:
+                yPos, intensities = _positiveEvents(eventFile["y"], eventFile["p"], timer)
+        yield yPos, intensities
+    elif eventPath.endswith(".mcpl") or eventPath.endswith(".mcpl.gz"):
+        yield from _iterMCPL(eventPath, chunkRows)
+    else:
+        yield from iterPSD(eventPath, startpoint, chunkRows)
+
+## _positiveEvents() keeps the events with a positive intensity, as for the .psd files
+def _positiveEvents(yPos, intensities, timer):
+    mask = intensities > 0
+    timer.eventsParsed = len(mask)
+    timer.eventsEmitted = int(mask.sum())
+    return np.asarray(yPos[mask], dtype = np.float64), np.asarray(intensities[mask], dtype = np.float64)
+
+## _iterMCPL() reads an MCPL file a block of chunkRows particles at a time. MCPL positions are in cm,
+## so they are turned into m like the y position of the .psd files.
+def _iterMCPL(eventPath, chunkRows):
+    ## mcpl is only needed for MCPL files, so it is imported here
+    try:
+        import mcpl
+    except ImportError:
+        raise ImportError(f"Reading {os.path.basename(eventPath)} needs the mcpl package (pip install mcpl)")
+    with stage("binary events") as timer:
+        timer.readFile(eventPath)
+        mcplFile = mcpl.MCPLFile(eventPath, blocklength = chunkRows)
+    try:
+        for particles in mcplFile.particle_blocks:
+            with stage("binary events") as timer:
+                ## The file was already counted once when it was opened
+                timer.calls = 0
+                yPos, intensities = _positiveEvents(particles.y/100, particles.weight, timer)
+            yield yPos, intensities
+    finally:
+        mcplFile.close()
+
+## readPSD() returns the y position and the intensity of every event with a positive intensity in the file
+## (see iterEvents()).
+def readPSD(filePath, startpoint = None):
+    blocks = list(iterEvents(filePath, startpoint))
+    if len(blocks) == 0:
+        return np.empty(0), np.empty(0)
+    if len(blocks) == 1:
+        return blocks[0]
+    return np.concatenate([yPos for yPos, intensities in blocks]), np.concatenate([intensities for yPos, intensities in blocks])
+
+## histogramPSD() reads the file and histograms the events into the 1024 detector pixels,
+## weighted by their intensity. This is what both the calibration and the data loading need.
+## Only one block of events (see iterPSD()) is in memory at a time.
+def histogramPSD(filePath, startpoint = None):
+    histogrammedData = np.zeros(pixelNum)
+    for yPos, intensities in iterEvents(filePath, startpoint):
+        with stage("histogramming") as timer:
+            histogrammedData += np.histogram(yPos, bins = pixelNum, weights = intensities, range = detectorRange)[0]
+            timer.eventsParsed = len(yPos)
+            timer.eventsEmitted = pixelNum
+    return histogrammedData
+
+## convertEvents() writes a .npy file (see binaryFormats) next to every .psd file in folderPath and all its
+## subfolders, for example a whole calibration or data folder, so later loads don't have to parse any text:
+##   convertEvents(os.path.join(instrument.pathBase, "dataFolder"), instrument.startpoint())
+## Only the events with a positive intensity are kept. The .npy file is written a block at a time, so the
+## memory needed doesn't depend on the size of the .psd file. With remove = True the .psd files are deleted
+## once they are converted. startpoint is the number of header lines, found with findStartpoint() if not given.
+## It returns the number of files converted.
+def convertEvents(folderPath, startpoint = None, remove = False):
+    converted = 0
+    for root, dirs, files in os.walk(folderPath):
+        for file in sorted(files):
+            if not file.endswith(".psd"):
+                continue
+            filePath = os.path.join(root, file)
+            npyPath = os.path.splitext(filePath)[0] + ".npy"
+            rows = 0
+            ## The events are written to a raw file first, since the number of events (which is in the
+            ## header of the .npy file) is only known at the end
+            try:
+                with open(npyPath + ".raw", "wb") as rawFile:
+                    for yPos, intensities in iterPSD(filePath, startpoint):
+                        rawFile.write(np.column_stack([intensities, yPos]).tobytes())
+                        rows += len(yPos)
+                ## The .npy file is written to a temporary file and then renamed, so an interrupted conversion
+                ## never leaves a half written .npy file that would be read in place of the .psd file
+                with open(npyPath + ".raw", "rb") as rawFile, open(npyPath + ".tmp", "wb") as npyFile:
+                    np.lib.format.write_array_header_1_0(npyFile, {"descr": np.lib.format.dtype_to_descr(np.dtype(np.float64)),
+                                                                      "fortran_order": False, "shape": (rows, 2)})
+                    for block in iter(lambda: rawFile.read(1 << 24), b""):
+                        npyFile.write(block)
+                os.replace(npyPath + ".tmp", npyPath)
+            finally:
+                for leftover in [npyPath + ".raw", npyPath + ".tmp"]:
+                    if os.path.exists(leftover):
+                        os.remove(leftover)
+            if remove == True:
+                os.remove(filePath)
+            converted += 1
+    return converted
@@ -9,9 +9,11 @@
 ## Necessary import statements
 import matplotlib.pyplot as plt
 import numpy as np
-import scipy
-from lmfit.models import * 
 from datetime import datetime as dt
+from DataCube import DataCube
+## The calculations behind every plot are done in Analysis.py without drawing anything (see there),
+## they are imported here so they can be used from this module as well
+from Analysis import cut2DData, cut1DData, resolutionData, cut2DErrorData, resolutionMoments, histogramChunks
 
 ## Now you can take a look at the various plotting features included in this library
 ## It's currently designed for simulations and for the simple cubic sample used, and such
@@ -21,30 +23,37 @@ from datetime import datetime as dt
 ## in the pandas dataframe. Please print out a portion of the DataFrame if you are uncertain
 ## about how the variables are named
 
-## cut2D requires the instrument and the dataframe prepared in the DataLoader.py
-## It also will require the x-axis and y-axis variable, xVar and yVar you wish to plot (likely Qx, Qy, E).
-## The color of the plot will always be the intensity of the signal.
-## This will be plotted such that the third variable you are not putting on your axis, integrationVar,
-## is held at a constant value intergrationVal with an acceptance of integrationWidth.
-## the optional variables xlim, ylim, and colorBarLim, control the limits of the axes
-## you can also set the saveFile = True to save the file as a pdf in the directory
-## where the data is located.
-def cut2D(instrument, dataframe, xVar, yVar, integrationVar, integrationVal, integrationWidth, 
-          xlim = None, ylim = None, colorBarLim = None, saveFile= False):
-    ## First we access the relevant data within the integration Volume
+## Every function below that takes the dataframe also accepts an EventIndex (see EventIndex.py) built from it,
+## which makes selecting the integration volume much faster, especially for resolution() and cut2DError(),
+## or a DataCube (see DataCube.py), where the events are already histogrammed and every cut is a sum over the cube.
 
-    ## Include the try except clause in case there was a mistake in 
-    ## xVar or yVar
-    try:
-        data = dataframe[dataframe[integrationVar] > integrationVal-integrationWidth]
-    except:
-        print(f"{integrationVar} was not recognized as a variable within the dataframe!")
-        return None
-    data = data[data[integrationVar] < integrationVal + integrationWidth]
+## Each plotting function first calculates its results with the matching function of Analysis.py, and then draws
+## them with one of the plot functions (plotCut2D(), plotCut1D(), plotResolution() and plotCut2DError()).
+## To get the numbers without drawing anything, for example on a cluster, use the Analysis.py functions directly
+## and draw their results later (or never) with the plot functions.
+
+## _plotEvents() draws the events of data (already inside the integration volume) with xVar and yVar on the axes
+## and the color showing the intensity, for cut2D() and cut2DError(). A DataCube is drawn as an image of its bins.
+## With render = "image" the events are histogrammed onto a gridSize grid (see _plotImage()) instead of scattered.
+def _plotEvents(data, xVar, yVar, colorBarLim, render = "scatter", gridSize = 200, aggregation = "sum",
+                xlim = None, ylim = None):
+    if isinstance(data, DataCube):
+        if sorted(data.variables) != sorted([xVar, yVar]):
+            print(f"{xVar} and or {yVar} were not recognized as variables within the dataframe!")
+            return
+        hist = data.hist if data.variables == [xVar, yVar] else data.hist.T
+        xEdges, yEdges = data.edges[data.variables.index(xVar)], data.edges[data.variables.index(yVar)]
+        if colorBarLim != None:
+            plt.pcolormesh(xEdges, yEdges, hist.T, vmin = colorBarLim[0], vmax = colorBarLim[1], rasterized = True)
+        else:
+            plt.pcolormesh(xEdges, yEdges, hist.T, rasterized = True)
+        return
+    if render == "image":
+        _plotImage(data, xVar, yVar, colorBarLim, gridSize, aggregation, xlim, ylim)
+        return
     ## Next we sort the values such that most intense is plotted last
     ## this is essential for the scatterplot method used
     data = data.sort_values(by="Intensity")
-    
     ##Now we plot using plt.scatter, with vmin and vmax controlling the colorbar intensityh
     try:
         if colorBarLim != None:
@@ -55,6 +64,87 @@ def cut2D(instrument, dataframe, xVar, yVar, integrationVar, integrationVal, int
             plt.scatter(data[xVar], data[yVar], c=data["Intensity"], s=8)
     except:
         print(f"{xVar} and or {yVar} were not recognized as variables within the dataframe!")
+
+## _checkRender() makes sure the render and aggregation options are ones that are understood
+def _checkRender(render, aggregation):
+    if render != "scatter" and render != "image":
+        print("render not recognized! Please specify as 'scatter' or 'image'.")
+        return False
+    if aggregation != "sum" and aggregation != "mean" and aggregation != "max":
+        print("aggregation not recognized! Please specify as 'sum', 'mean', or 'max'.")
+        return False
+    return True
+
+## _plotImage() draws the events as an image: the plot is divided into a grid of gridSize pixels (one number, or
+## (xPixels, yPixels)) over xlim and ylim (or the range of the events), and each pixel shows the intensity of the
+## events that land in it. aggregation controls how they are combined: "sum" (the total intensity), "mean" or "max".
+## Pixels with no events are left blank like in the scatter plot. Unlike the scatter plot, the time it takes to draw
+## and the size of a saved pdf do not grow with the number of events.
+def _plotImage(data, xVar, yVar, colorBarLim, gridSize, aggregation, xlim, ylim):
+    try:
+        xValues, yValues, intensities = np.asarray(data[xVar]), np.asarray(data[yVar]), np.asarray(data["Intensity"])
+    except:
+        print(f"{xVar} and or {yVar} were not recognized as variables within the dataframe!")
+        xValues, yValues, intensities = np.empty(0), np.empty(0), np.empty(0)
+    if np.ndim(gridSize) == 0:
+        gridSize = (gridSize, gridSize)
+    ## Without any events an empty image is still drawn (over xlim and ylim, or 0 to 1), so the colorbar has something to show
+    if xlim == None:
+        xlim = (xValues.min(), xValues.max()) if len(xValues) > 0 else (0, 1)
+    if ylim == None:
+        ylim = (yValues.min(), yValues.max()) if len(yValues) > 0 else (0, 1)
+    xEdges = np.linspace(xlim[0], xlim[1], gridSize[0] + 1)
+    yEdges = np.linspace(ylim[0], ylim[1], gridSize[1] + 1)
+    counts, _, _ = np.histogram2d(xValues, yValues, bins = [xEdges, yEdges])
+    if aggregation == "max":
+        ## np.histogram2d() can only add, so the maximum is found with the pixel number of every event
+        inside = (xValues >= xEdges[0]) & (xValues <= xEdges[-1]) & (yValues >= yEdges[0]) & (yValues <= yEdges[-1])
+        xPixels = np.clip(np.searchsorted(xEdges, xValues[inside], side = "right") - 1, 0, gridSize[0] - 1)
+        yPixels = np.clip(np.searchsorted(yEdges, yValues[inside], side = "right") - 1, 0, gridSize[1] - 1)
+        image = np.full(gridSize, -np.inf)
+        np.maximum.at(image, (xPixels, yPixels), intensities[inside])
+    else:
+        image, _, _ = np.histogram2d(xValues, yValues, bins = [xEdges, yEdges], weights = intensities)
+        if aggregation == "mean":
+            image = image/np.maximum(counts, 1)
+    image = np.where(counts > 0, image, np.nan)
+    if colorBarLim != None:
+        plt.imshow(image.T, origin = "lower", extent = (xEdges[0], xEdges[-1], yEdges[0], yEdges[-1]), aspect = "auto",
+                   interpolation = "nearest", vmin = colorBarLim[0], vmax = colorBarLim[1])
+    else:
+        plt.imshow(image.T, origin = "lower", extent = (xEdges[0], xEdges[-1], yEdges[0], yEdges[-1]), aspect = "auto",
+                   interpolation = "nearest")
+
+## cut2D requires the instrument and the dataframe prepared in the DataLoader.py
+## It also will require the x-axis and y-axis variable, xVar and yVar you wish to plot (likely Qx, Qy, E).
+## The color of the plot will always be the intensity of the signal.
+## This will be plotted such that the third variable you are not putting on your axis, integrationVar,
+## is held at a constant value intergrationVal with an acceptance of integrationWidth.
+## the optional variables xlim, ylim, and colorBarLim, control the limits of the axes
+## you can also set the saveFile = True to save the file as a pdf in the directory
+## where the data is located.
+## render controls how the events are drawn. render = "scatter" (the default) draws every event as a point,
+## render = "image" histograms them onto a grid of gridSize pixels (one number or (xPixels, yPixels)) and
+## draws that as an image, which is much faster and makes much smaller pdfs for large datasets. The pixels
+## show the summed intensity by default; aggregation = "mean" or "max" shows the mean or maximum instead.
+def cut2D(instrument, dataframe, xVar, yVar, integrationVar, integrationVal, integrationWidth, 
+          xlim = None, ylim = None, colorBarLim = None, saveFile= False, render = "scatter", gridSize = 200,
+          aggregation = "sum"):
+    if _checkRender(render, aggregation) == False:
+        return None
+    ## First we access the relevant data within the integration Volume
+    result = cut2DData(dataframe, integrationVar, integrationVal, integrationWidth)
+    if result == None:
+        return None
+    plotCut2D(instrument, result, xVar, yVar, xlim, ylim, colorBarLim, saveFile, render, gridSize, aggregation)
+
+## plotCut2D() draws the result of cut2DData() in Analysis.py, with the same options as cut2D()
+def plotCut2D(instrument, result, xVar, yVar, xlim = None, ylim = None, colorBarLim = None, saveFile = False,
+              render = "scatter", gridSize = 200, aggregation = "sum"):
+    if _checkRender(render, aggregation) == False:
+        return None
+    integrationVar, integrationVal, integrationWidth = result["integrationVar"], result["integrationVal"], result["integrationWidth"]
+    _plotEvents(result["data"], xVar, yVar, colorBarLim, render, gridSize, aggregation, xlim, ylim)
     plt.colorbar(label = "Intensity (a.u.)")
     ## The rest just controls the axes labels and makes it so they use LaTeX font
     ## if applicable
@@ -87,7 +177,6 @@ def cut2D(instrument, dataframe, xVar, yVar, integrationVar, integrationVal, int
         plt.savefig(f"{instrument.pathBase}/{instrument.stations}_Stations_Mosaic_{instrument.mosaic}_{integrationVar}_{integrationVal}_{dt.now().strftime('%Y_%m_%d_%H_%M_%S')}.pdf", format = "pdf")
     plt.show()
 
-
 ## The next function creates a 1D plot with one variable where the y-axis is the intensity
 ## The data is automatically fit to a Gaussian, which lends itself to resolution calculations
 ## Because this is a scatter plot that is fit to a Gaussian, with a very large number of marginally different
@@ -111,90 +200,44 @@ def cut2D(instrument, dataframe, xVar, yVar, integrationVar, integrationVal, int
 def cut1D(instrument, dataframe, xVar, binSize, integrationVar1, integrationVal1, integrationWidth1, integrationVar2, 
           integrationVal2, integrationWidth2, threshold = None, binRange = None, ylim = None,
           showPlot = True, saveFile=False):
-    ## Here we extract the integration region that's valid.
-    ## Try except blocks are included in case integrationVar1 or integrationVar2 are incorrectly named.
-    try:
-        data = dataframe[dataframe[integrationVar1] > integrationVal1-integrationWidth1]
-    except:
-        print(f"{integrationVar1} was not recognized as a variable within the dataframe!")
-        return None
-
-    data = data[data[integrationVar1] < integrationVal1 + integrationWidth1]
-    try:
-        data = data = data[data[integrationVar2] > integrationVal2-integrationWidth2]
-    except:
-        print(f"{integrationVar2} was not recognized as a variable within the dataframe!")
+    ## The histogram and the Gaussian fit are calculated by cut1DData() in Analysis.py
+    result = cut1DData(dataframe, xVar, binSize, integrationVar1, integrationVal1, integrationWidth1, integrationVar2,
+                       integrationVal2, integrationWidth2, threshold = threshold, binRange = binRange)
+    if result == None:
         return None
-    
-    data = data[data[integrationVar2] < integrationVal2 + integrationWidth2]
-    ## Here we control the minimum regions to be plotted based off the binRange
-    ## This is needed for the gaussian fit
-    if binRange == None:
-        minVal, maxVal = data[xVar].min(), data[xVar].max()
-
-    else:
-        minVal, maxVal = binRange[0], binRange[1]
-    ## Now the data is histogrammed based off the intensity. This is to help the identification of a clear Gaussian 
-    ## peak. the binsizes are controlled by binSize, and the binRange specified.
-    histData, binEdges = np.histogram(data[xVar], weights=data["Intensity"], bins = np.arange(minVal, maxVal, binSize))
-    binCenters = binEdges[:-1]  + (binEdges[1] - binEdges[0])
-    ## Now the index of the peak is found, which is essential for the Gaussian fitting
-    ## The prominence term controls the minimum height it will look for for fitting
-    ## The distance variable sets the minimum distance between peaks, and is there to help prevent
-    ## overfitting. This is the the most nitpicky of the variables, and is highly dependent on 
-    ## where you are fitting. Currently I have it set such that the distance scales automatically
-    ## with the number of bins, but the exact scale factor is tricky. Optimization may be needed
-    ## here.
-    i_pk, _ = scipy.signal.find_peaks(histData, distance = len(binCenters)//3, prominence = threshold)
-    
-    ## Now we prepare the gaussian fitting package using LmFit.
-    gaussModel = GaussianModel()
-    ## this is the natural sequence for looking at multiple Gaussians.
-    pars = gaussModel.guess(data=histData, x = binCenters)
-    modelList = []
-    ## setting up the initial guesses which it will refine from,.
-    ## the procedure is identical to that described in Calibration.py
-    ## For more details refer to there.
-    for i in range(len(i_pk)):
-        peak_index = i_pk[i]
-        gauss = GaussianModel(prefix=f'g{i+1}_')
-        pars.update(gauss.make_params())
-        pars[f'g{i+1}_center'].set(binCenters[peak_index])
-        pars[f'g{i+1}_sigma'].set(0.1)
-        pars[f'g{i+1}_amplitude'].set(histData[peak_index])
-        modelList.append(gauss)
-    modelArray = np.array(modelList)
-    model = np.sum(modelArray)
-    ## this is the actual fitting procedure
-    try:
-        out = model.fit(histData, pars, x=binCenters)
-    except:
+    if result["failed"] == True:
         ## If the fit fails, which can happen particularly if your binRange doesn't capture any peaks 
         ## (slope=0) and so itll ask to check on that.
         print(f"Fit Failed for {integrationVar1}={integrationVal1} {integrationVar2}={integrationVal2}")
         if binRange != None:
             print("Please check if your bin range is large enough!")
-            return None
+        return None
         ## now this controls the plotting
     if showPlot == True:
-        ## First the histogrammed raw data is plotted, and then the gaussian fit is overplotted
-        plt.scatter(binCenters, histData, marker = "x")
-        plt.plot(binCenters, out.best_fit)
+        plotCut1D(instrument, result, ylim, saveFile)
+    return result["bestValues"]
 
-        plt.xlabel(f"{xVar}")
-        plt.ylabel("Intensity (a.u.)")
-        plt.title(f"{instrument.stations} Stations Mosaic {instrument.mosaic}  {xVar} vs. Intensity {integrationVar1} = {integrationVal1} $\pm$ {integrationWidth1} {integrationVar2} = {integrationVal2} $\pm$ {integrationWidth2}")
-        ## This just gives the x-axis plotting size a little bit of extra space so the edges aren't defined by
-        ## binRange.
-        spacing = (maxVal-minVal)*0.05
-        plt.xlim(minVal-spacing, maxVal+spacing)
-        if ylim != None:
-            plt.ylim(ylim[0], ylim[1])
-        ## Figures saved as pdfs by default if saveFig set to true.
-        if saveFile == True:
-            plt.savefig(f"{instrument.pathBase}/{instrument.stations}_Stations_Mosaic_{instrument.mosaic}_{xVar}_v_Intensity_{dt.now().strftime('%Y_%m_%d_%H_%M_%S')}.pdf", format = "pdf")
-        plt.show()
-    return out.best_values
+## plotCut1D() draws the result of cut1DData() in Analysis.py, with the same options as cut1D()
+def plotCut1D(instrument, result, ylim = None, saveFile = False):
+    xVar, minVal, maxVal = result["xVar"], result["minVal"], result["maxVal"]
+    ## First the histogrammed raw data is plotted, and then the gaussian fit is overplotted
+    plt.scatter(result["binCenters"], result["histogram"], marker = "x")
+    if result["failed"] == False:
+        plt.plot(result["binCenters"], result["bestFit"])
+
+    plt.xlabel(f"{xVar}")
+    plt.ylabel("Intensity (a.u.)")
+    plt.title(f"{instrument.stations} Stations Mosaic {instrument.mosaic}  {xVar} vs. Intensity {result['integrationVar1']} = {result['integrationVal1']} $\pm$ {result['integrationWidth1']} {result['integrationVar2']} = {result['integrationVal2']} $\pm$ {result['integrationWidth2']}")
+    ## This just gives the x-axis plotting size a little bit of extra space so the edges aren't defined by
+    ## binRange.
+    spacing = (maxVal-minVal)*0.05
+    plt.xlim(minVal-spacing, maxVal+spacing)
+    if ylim != None:
+        plt.ylim(ylim[0], ylim[1])
+    ## Figures saved as pdfs by default if saveFig set to true.
+    if saveFile == True:
+        plt.savefig(f"{instrument.pathBase}/{instrument.stations}_Stations_Mosaic_{instrument.mosaic}_{xVar}_v_Intensity_{dt.now().strftime('%Y_%m_%d_%H_%M_%S')}.pdf", format = "pdf")
+    plt.show()
 
 ## The resolution function depends heavily on the cut1D function
 ## Essentially, it sweeps over xVar and performs a resolution calculation for
@@ -215,58 +258,50 @@ def cut1D(instrument, dataframe, xVar, binSize, integrationVar1, integrationVal1
 ## ylim controls the y-axis scale, but xlim will also control the number of points
 ## cut1D is calculated at. Essentially the points sweeped are in range(xlim[0], xlim[1], xStepSize)
 ## The actual plotted x-axis range is slightly larger than the specified range.
+## method = "moments" calculates the whole sweep at once with resolutionMoments() (see Analysis.py) instead of
+## calling cut1D() for every point, which is much faster. refine is passed to resolutionMoments().
+## It needs the events, so it raises a TypeError for a DataCube.
+## workers (optional) is the number of processes the cut1D() fits are spread over (see _sweepFits() in Analysis.py).
+## Note that on Windows the call needs to be inside an
+## if __name__ == "__main__": block when running from a script.
 def resolution(instrument, dataframe, xVar, xStepSize, resVar,
                 binSize, integrationVar, integrationVal, integrationWidth,   
                 threshold = None, binRange = None, xlim = None, ylim = None,
-                showCuts = False, saveCuts=False, saveFile=False):
-    
-    ## The below lists will be appended to and plotted
-    xVarList = []
-    resList = []
-
-    ## This controls the range which the resolution is calculated
-    ## If not specified, it'll just go to the min and max values within the dataframe
-    if xlim == None:
-        xMin, xMax = dataframe[xVar].min(), dataframe[xVar].max()
-    else:
-        xMin, xMax = xlim[0], xlim[1] 
-    for num in np.arange(xMin, xMax, xStepSize):
-        try:
-            ## Now the outputted fit from cut1D, which will output a 
-            ## dictionary with the best fit parameters
-            ## is below
-            bestFit = cut1D(instrument=instrument, dataframe=dataframe, 
-                            xVar = resVar, binSize = binSize,
-                            integrationVar1=integrationVar, integrationVal1 = integrationVal, 
-                            integrationWidth1 = integrationWidth, integrationVar2 = xVar,
-                            integrationVal2= num, integrationWidth2 = xStepSize/2, 
-                            threshold=threshold, binRange = binRange,
-                            showPlot=showCuts, saveFile=saveCuts)
-        except:
-            ## Some values may not work, so the points it fails at are printed. However, in some cases
-            ## this is quite normal so the loop will continue instead of breaking.
-            print(f"Resolution calculation of {resVar} failed at  {xVar} = {num}, {integrationVar} = {integrationVal}, ")
-            continue
-        if bestFit== None:
-            continue    
-        try:
-            ## As the fit will automatically try fitting multiple Gaussians
-            ## the secondPeak term will warn you of this. It will prevent
-            ## any point in which multiple peaks are found from being plotted.
-            ## this is when the binRange and threshold parameters are extremely useful
-            ## I recommend plotting to see what causes this.
-            testCenter = bestFit['g2_center']
-            print("Warning! Multiple Gaussian peaks were found at the same value of "\
-                f"{xVar} = {num}. Please change your xRange or the threshold"\
-                    " variable to make sure there is only one peak used for "\
-                        "calculating the resolution!")
-            continue
-        except:
-            pass
-        ## If the fit is successful, the x point and the y point are appended to the list
+                showCuts = False, saveCuts=False, saveFile=False, method = "fit", refine = False, workers = None):
+    if method != "fit" and method != "moments":
+        print("method not recognized! Please specify as 'fit' or 'moments'.")
+        return None
+    ## The sweep is calculated by resolutionData() in Analysis.py
+    result = resolutionData(dataframe, xVar, xStepSize, resVar, binSize, integrationVar, integrationVal, integrationWidth,
+                            threshold = threshold, binRange = binRange, xlim = xlim, method = method, refine = refine,
+                            workers = workers)
+    if result == None:
+        return None
+    ## If you would like to see each individual cut, they are plotted with plotCut1D()
+    if showCuts == True:
+        for cut in result["cuts"]:
+            plotCut1D(instrument, cut, saveFile = saveCuts)
+    ## Some values may not work, so the points it fails at are printed. However, in some cases
+    ## this is quite normal so the sweep continues instead of stopping.
+    for num in result["failed"]:
+        print(f"Resolution calculation of {resVar} failed at  {xVar} = {num}, {integrationVar} = {integrationVal}, ")
+    ## As the fit will automatically try fitting multiple Gaussians
+    ## this will warn you of any point in which multiple peaks are found, which are not plotted.
+    ## this is when the binRange and threshold parameters are extremely useful
+    ## I recommend plotting to see what causes this.
+    for num in result["multiplePeaks"]:
+        print("Warning! Multiple Gaussian peaks were found at the same value of "\
+            f"{xVar} = {num}. Please change your xRange or the threshold"\
+                " variable to make sure there is only one peak used for "\
+                    "calculating the resolution!")
+    plotResolution(instrument, result, xlim, ylim, saveFile)
+    ## note that the resolution x and y values are returned, and thus can be stored if desired.
+    ## It is also used in resolutionComp()
+    return (result["x"], result["fwhm"])
 
-        xVarList.append(num)
-        resList.append(bestFit['g1_sigma']*2.355)
+## plotResolution() draws the result of resolutionData() in Analysis.py, with the same options as resolution()
+def plotResolution(instrument, result, xlim = None, ylim = None, saveFile = False):
+    xVar, resVar, xVarList, resList = result["xVar"], result["resVar"], result["x"], result["fwhm"]
     ## The fit is then plotted with a line and a scatterplot
     plt.plot(xVarList, resList)
     plt.scatter(xVarList, resList, marker = "x")
@@ -299,9 +334,6 @@ def resolution(instrument, dataframe, xVar, xStepSize, resVar,
     if saveFile == True:
         plt.savefig(f"{instrument.pathBase}/{instrument.stations}_Stations_Mosaic_{instrument.mosaic}_{xVar}_v_{resVar}_Res_{dt.now().strftime('%Y_%m_%d_%H_%M_%S')}.pdf", format = "pdf")
     plt.show()    
-    ## note that the resolution x and y values are returned, and thus can be stored if desired.
-    ## It is also used in resolutionComp()
-    return (xVarList, resList)
 
 
 ## The function below is in the event you want to compare different resolutions.
@@ -403,117 +435,43 @@ def resolutionComp(instrumentList, resxy, xVar, resVar, xlim = None, ylim = None
 ## ylim controls the y-axis scale, but xlim will also control the number of points
 ## cut1D is calculated at. Essentially the points sweeped are in range(xlim[0], xlim[1], xStepSize)
 ## The actual plotted x-axis range is slightly larger than the specified range.
+## render, gridSize and aggregation control how the events behind the error bars are drawn, as in cut2D().
+## workers spreads the cut1D() fits over several processes, as in resolution().
 def cut2DError(instrument, dataframe, xVar, xStepSize, xWidth, binSize, yVar, integrationVar, integrationVal, integrationWidth, 
           xlim = None, ylim = None, colorBarLim = None, saveFile= False, threshold = None, binRange = None,
-                showCuts = False, saveCuts=False):
-    ## First we access the relevant data within the integration Volume
-
-    ## Include the try except clause in case there was a mistake in 
-    ## xVar or yVar
-    try:
-        data = dataframe[dataframe[integrationVar] > integrationVal-integrationWidth]
-    except:
-        print(f"{integrationVar} was not recognized as a variable within the dataframe!")
+                showCuts = False, saveCuts=False, render = "scatter", gridSize = 200, aggregation = "sum", workers = None):
+    if _checkRender(render, aggregation) == False:
         return None
-    data = data[data[integrationVar] < integrationVal + integrationWidth]
-    ## Next we sort the values such that most intense is plotted last
-    ## this is essential for the scatterplot method used
-    data = data.sort_values(by="Intensity")
-    
-
-    xVarList = []
-    yVarCens = []
-    resList = []
+    ## The sweep (and the events within the integration volume) are calculated by cut2DErrorData() in Analysis.py
+    result = cut2DErrorData(dataframe, xVar, xStepSize, xWidth, binSize, yVar, integrationVar, integrationVal,
+                            integrationWidth, xlim = xlim, threshold = threshold, binRange = binRange, workers = workers)
+    if result == None:
+        return None
+    if showCuts == True:
+        for cut in result["cuts"]:
+            plotCut1D(instrument, cut, saveFile = saveCuts)
+    ## Some values may not work, so the points it fails at are printed. However, in some cases
+    ## this is quite normal so the sweep continues instead of stopping.
+    for num in result["failed"]:
+        print(f"Resolution calculation of {yVar} failed at  {xVar} = {num}, {integrationVar} = {integrationVal}, ")
+    ## As the fit will automatically try fitting multiple Gaussians
+    ## this will warn you of any point in which multiple peaks are found, which are not plotted.
+    for num in result["multiplePeaks"]:
+        print("Warning! Multiple Gaussian peaks were found at the same value of "\
+            f"{xVar} = {num}. Please change your xRange or the threshold"\
+                " variable to make sure there is only one peak used for "\
+                    "calculating the resolution!")
+    plotCut2DError(instrument, result, xlim, ylim, colorBarLim, saveFile, render, gridSize, aggregation)
+    print(result["x"])
+    print(result["errors"])
+    ## The points, centers and errors are returned, and thus can be stored if desired.
+    return (result["x"], result["centers"], result["errors"])
 
-    ## This controls the range which the resolution is calculated
-    ## If not specified, it'll just go to the min and max values within the dataframe
-    if xlim == None:
-        xMin, xMax = dataframe[xVar].min(), dataframe[xVar].max()
-    else:
-        xMin, xMax = xlim[0], xlim[1] 
-    for num in np.arange(xMin, xMax, xStepSize):
-        try:
-            ## Now the outputted fit from cut1D, which will output a 
-            ## dictionary with the best fit parameters
-            ## is below
-            bestFit = cut1D(instrument=instrument, dataframe=dataframe, 
-                            xVar = yVar, binSize = binSize,
-                            integrationVar1=integrationVar, integrationVal1 = integrationVal, 
-                            integrationWidth1 = integrationWidth, integrationVar2 = xVar,
-                            integrationVal2= num, integrationWidth2 = xWidth, 
-                            threshold=threshold, binRange = binRange,
-                            showPlot=showCuts, saveFile=saveCuts)
-        except:
-        ## Some values may not work, so the points it fails at are printed. However, in some cases
-        ## this is quite normal so the loop will continue instead of breaking.
-            print(f"Resolution calculation of {yVar} failed at  {xVar} = {num}, {integrationVar} = {integrationVal}, ")
-            plt.show()
-            continue
-        if bestFit== None:
-            continue    
-        try:
-            ## As the fit will automatically try fitting multiple Gaussians
-            ## the secondPeak term will warn you of this. It will prevent
-            ## any point in which multiple peaks are found from being plotted.
-            ## this is when the binRange and threshold parameters are extremely useful
-            ## I recommend plotting to see what causes this.
-            testCenter = bestFit['g2_center']
-            print("Warning! Multiple Gaussian peaks were found at the same value of "\
-                f"{xVar} = {num}. Please change your xRange or the threshold"\
-                    " variable to make sure there is only one peak used for "\
-                        "calculating the resolution!")
-            print(bestFit)
-            continue
-        except:
-            pass
-        xVarList.append(num)
-        yVarCens.append(bestFit['g1_center'])
-        resList.append(bestFit['g1_sigma']*2.355/2)
-    
+## plotCut2DError() draws the result of cut2DErrorData() in Analysis.py, with the same options as cut2DError()
+def plotCut2DError(instrument, result, xlim = None, ylim = None, colorBarLim = None, saveFile = False,
+                   render = "scatter", gridSize = 200, aggregation = "sum"):
     ##Now the errors, centers, and resolutions are plotted with plt.errorBar
     
-    plt.errorbar(xVarList, yVarCens, resList, capsize=5, elinewidth=0.6, ecolor = "cyan", ls = "none")
-    ##Now we plot using plt.scatter, with vmin and vmax controlling the colorbar intensityh
-    try:
-        if colorBarLim != None:
-            ##c  controls the color such that it corresponds to the intensity of the event.
-            plt.scatter(data[xVar], data[yVar], c=data["Intensity"], s=8, vmin=colorBarLim[0], 
-                        vmax = colorBarLim[1])
-        else:
-            plt.scatter(data[xVar], data[yVar], c=data["Intensity"], s=8)
-    except:
-        print(f"{xVar} and or {yVar} were not recognized as variables within the dataframe!")
-    plt.colorbar(label = "Intensity (a.u.)")
-    ## The rest just controls the axes labels and makes it so they use LaTeX font
-    ## if applicable
-    if xlim !=None:
-        plt.xlim(xlim[0], xlim[1])
-    if ylim != None:
-        plt.ylim(ylim[0], ylim[1])
-    if xVar == "Qy":
-        plt.xlabel("$Q_y~(\AA^{-1})$")
-    elif xVar == "Qx":
-        plt.xlabel("$Q_x~(\AA^{-1})$")
-    elif xVar == "E":
-        plt.xlabel("$E$ (meV)")
-    else:
-        plt.xlabel(f"{xVar}")
-    ##
-    if yVar == "Qy":
-        plt.ylabel("$Q_y~(\AA^{-1})$")
-    elif yVar == "Qx":
-        plt.ylabel("$Q_x~(\AA^{-1})$")
-    elif yVar == "E":
-        plt.ylabel("$E$ (meV)")
-    else:
-        plt.ylabel(f"{yVar}")
-    ## This just sets the title to the following default
-    ## Can be customized according to a users discretion
-    plt.title(f"{instrument.stations} Stations Mosaic {instrument.mosaic} {integrationVar} = {integrationVal} $\pm$ {integrationWidth}")
-    ## Saves the file if desired by the user
-    if saveFile == True:
-        plt.savefig(f"{instrument.pathBase}/{instrument.stations}_Stations_Mosaic_{instrument.mosaic}_{integrationVar}_{integrationVal}_{dt.now().strftime('%Y_%m_%d_%H_%M_%S')}.pdf", format = "pdf")
-    plt.show()
-    print(xVarList)
-    print(resList)
-
+    plt.errorbar(result["x"], result["centers"], result["errors"], capsize=5, elinewidth=0.6, ecolor = "cyan", ls = "none")
+    ## and the events within the integration volume are drawn behind them like in cut2D()
+    plotCut2D(instrument, result, result["xVar"], result["yVar"], xlim, ylim, colorBarLim, saveFile, render, gridSize, aggregation)
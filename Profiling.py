@@ -0,0 +1,161 @@
+## The Profiling module shows where the time of a run goes. Calibration.py, DataLoader.py, PSDReader.py, EventTable.py
+## and Analysis.py mark each stage of the pipeline with stage(), and while profiling is on every stage records its
+## wall time, the bytes it read from disk, the events it parsed and the events it produced:
+##   file discovery          listing the scan point folders (the events produced are the folders found)
+##   psd_tube parameters     reading Ei, Two Theta and psi from psd_tube1_1a.dat
+##   .psd parsing            reading the ReuterStokes .psd files (events parsed, and kept with a positive intensity)
+##   binary events           reading the binary event files used in place of .psd files (see PSDReader.py)
+##   histogramming           histogramming the events of a .psd file into the 1024 pixels
+##   calibration matmul      redistributing the histograms of a folder over the Efs of the calibration
+##   dataframe build         building the dataframe (or EventTable) of events
+##   Q/E derivation          calculating E, ki, kf, Qx and Qy
+##   calibration fit         each lmfit fit in calibration()
+##   cut1D fit               each lmfit fit in cut1D() (and the resolution() and cut2DError() sweeps)
+## For example, to find out whether a slow load is limited by the disk, the parsing or the fitting:
+##   with profiling("load.prof"):
+##       mantaCalibration = calibration(instrument, "calibrationFolder")
+##       mantaData = dataLoader(instrument, mantaCalibration, "dataFolder")
+##   print(profileSummary())
+## "load.prof" (optional) is a cProfile dump of the same run, which can be opened with pstats or snakeviz.
+## The stages run in worker processes (workers = ...) are sent back and added to the summary, but the cProfile dump
+## only covers this process. When profiling is off stage() does nothing, so it costs nothing.
+
+##Here are the necessary import statements for this file
+import pandas as pd
+import os
+import time
+import threading
+import cProfile
+from contextlib import contextmanager
+
+## _stages holds {stage: [calls, seconds, bytesRead, eventsParsed, eventsEmitted]} while profiling is on, and is None otherwise
+_stages = None
+## The stages can be recorded from several threads at once (dataLoader(pool = "thread"))
+_lock = threading.Lock()
+summaryColumns = ["stage", "calls", "seconds", "bytesRead", "eventsParsed", "eventsEmitted"]
+
+class _Stage:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 1
+        self.bytesRead = 0
+        self.eventsParsed = 0
+        self.eventsEmitted = 0
+
+    ## readFile() adds the size of the file at filePath to the bytes read by the stage
+    def readFile(self, filePath):
+        try:
+            self.bytesRead += os.path.getsize(filePath)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *error):
+        _record(self.name, [self.calls, time.perf_counter() - self.start, self.bytesRead, self.eventsParsed, self.eventsEmitted])
+        return False
+
+## _NoStage is used while profiling is off, everything it is given is ignored (and everything it has reads as 0)
+class _NoStage:
+    calls = 0
+    bytesRead = 0
+    eventsParsed = 0
+    eventsEmitted = 0
+
+    def readFile(self, filePath):
+        pass
+
+    def __setattr__(self, name, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *error):
+        return False
+
+_noStage = _NoStage()
+
+## stage() times the code inside a with block as the stage name. The block can add to the bytes read
+## (with readFile()) and set eventsParsed and eventsEmitted on the object it gets:
+##   with stage(".psd parsing") as timer:
+##       timer.readFile(filePath)
+##       ...
+##       timer.eventsParsed = len(events)
+def stage(name):
+    if _stages is None:
+        return _noStage
+    return _Stage(name)
+
+def _record(name, values):
+    with _lock:
+        if _stages is None:
+            return
+        totals = _stages.setdefault(name, [0, 0., 0, 0, 0])
+        for column, value in enumerate(values):
+            totals[column] += value
+
+def profilingEnabled():
+    return _stages is not None
+
+## enableProfiling() starts recording the stages (from zero), disableProfiling() stops. The stages recorded
+## so far are kept until the next enableProfiling(), so profileSummary() can still be called after disableProfiling().
+_lastStages = {}
+def enableProfiling():
+    global _stages
+    _stages = {}
+
+def disableProfiling():
+    global _stages, _lastStages
+    if _stages is not None:
+        _lastStages = _stages
+    _stages = None
+
+## profileSummary() returns a dataframe with a row for each stage, in the order the stages were first reached:
+## the number of times it ran, the total seconds, bytes read, events parsed and events produced.
+## When workers are used the seconds are added up over all processes, so they can be more than the wall time.
+def profileSummary():
+    stages = _stages if _stages is not None else _lastStages
+    with _lock:
+        rows = [[name] + list(values) for name, values in stages.items()]
+    return pd.DataFrame(rows, columns = summaryColumns)
+
+## profiling() turns profiling on for the code inside a with block. With cProfileFile the block is also run under
+## cProfile and the stats are dumped to that file at the end.
+@contextmanager
+def profiling(cProfileFile = None):
+    enableProfiling()
+    profiler = None
+    if cProfileFile != None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler != None:
+            profiler.disable()
+            profiler.dump_stats(cProfileFile)
+        disableProfiling()
+
+## profiledCall() runs function(*args) in a worker process with profiling on and returns (result, stages), so the
+## stages of the worker can be added to the summary of the main process by collectProfiles().
+## The pools in Calibration.py, DataLoader.py and Analysis.py use it when profiling is on.
+def profiledCall(function, *args):
+    global _stages
+    previous = _stages
+    _stages = {}
+    try:
+        result = function(*args)
+        return result, _stages
+    finally:
+        _stages = previous
+
+## collectProfiles() goes through the (result, stages) pairs of profiledCall(), adds the stages to the
+## summary and yields the results
+def collectProfiles(results):
+    for result, stages in results:
+        for name, values in stages.items():
+            _record(name, values)
+        yield result
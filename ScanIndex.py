@@ -0,0 +1,126 @@
+## The ScanIndex module keeps the scan parameters (Ei, Two Theta and psi) of every scan point folder of a dataset.
+## dataLoader() needs them for each folder, and they are written as "# Param: name=value" lines in the header of the
+## psd_tube1_1a.dat file of the folder. Rather than reading that file every time a dataset is loaded, the parameters
+## are read once (only the header, up to the first line of data) and kept in an index file inside the data folder,
+## next to the scan point folders. The next load only checks that each psd_tube1_1a.dat hasn't changed (its size
+## and modification time) and takes the parameters from the index.
+## The index can also be used to choose which folders to load before any events are read:
+##   index = scanIndex(os.path.join(instrument.pathBase, "dataFolder"))
+##   folders = selectScans(index, eiRange = (4.9, 5.1), psiRange = (0, 45))
+## and scanTable(index) shows every scan point as a dataframe.
+
+##Here are the necessary import statements for this file
+import pandas as pd
+import os
+import json
+import tempfile
+from Profiling import stage
+
+## The index is a hidden file in the data folder, so it is not mistaken for a scan point folder
+scanIndexFile = ".pcpa_scanIndex.json"
+## scanIndexVersion is written in the index, in case the way the parameters are read ever changes
+scanIndexVersion = 1
+## The parameters kept for each folder, with the names they have in the psd_tube1_1a.dat header
+scanParameters = ["Ei", "TwoTh", "psi"]
+
+## readScanParameters() reads Ei, TwoTh and psi from the header of a psd_tube1_1a.dat file. It returns a dict
+## {"Ei": ..., "TwoTh": ..., "psi": ...}, or None if the file is missing or one of the parameters isn't in the header.
+## Only the lines up to the first line of data are read.
+def readScanParameters(filePath):
+    params = {}
+    bytesRead = 0
+    with stage("psd_tube parameters") as timer:
+        try:
+            fileOpener = open(filePath, "r")
+        except FileNotFoundError:
+            return None
+        with fileOpener:
+            for line in fileOpener:
+                bytesRead += len(line)
+                splitLine = line.split()
+                if len(splitLine) == 0:
+                    continue
+                ## The header ends at the first line that isn't a comment
+                if not splitLine[0].startswith("#"):
+                    break
+                if len(splitLine) > 2 and splitLine[1] == "Param:":
+                    paramSplit = splitLine[2].split("=")
+                    if paramSplit[0] in scanParameters:
+                        params[paramSplit[0]] = float(paramSplit[1])
+                    if len(params) == len(scanParameters):
+                        break
+        timer.bytesRead = bytesRead
+    if len(params) == len(scanParameters):
+        return params
+    return None
+
+## _fileStamp() is the size and modification time of a file, or None if it doesn't exist
+def _fileStamp(filePath):
+    try:
+        stat = os.stat(filePath)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+## scanIndex() returns the scan parameters of every scan point folder in dataPath (the full path of the data folder),
+## as {folder: {"Ei": ..., "TwoTh": ..., "psi": ...}}. Folders where they could not be read (e.g. psd_tube1_1a.dat
+## is missing) are None. Only new folders and folders whose psd_tube1_1a.dat changed are read; the rest come from
+## the index file, which is updated if anything changed. rebuild = True reads every folder again.
+## If the data folder can't be written to, the index is still returned, it just isn't saved.
+def scanIndex(dataPath, rebuild = False):
+    indexPath = os.path.join(dataPath, scanIndexFile)
+    entries = {}
+    if rebuild == False and os.path.exists(indexPath):
+        try:
+            with open(indexPath, "r") as fileOpener:
+                saved = json.load(fileOpener)
+            if saved.get("version") == scanIndexVersion:
+                entries = saved["folders"]
+        except (OSError, ValueError, KeyError):
+            entries = {}
+    newEntries = {}
+    changed = False
+    for folder in sorted(os.listdir(dataPath)):
+        folderPath = os.path.join(dataPath, folder)
+        if not os.path.isdir(folderPath):
+            continue
+        filePath = os.path.join(folderPath, "psd_tube1_1a.dat")
+        stamp = _fileStamp(filePath)
+        if folder in entries and entries[folder]["stamp"] == stamp:
+            newEntries[folder] = entries[folder]
+            continue
+        params = None
+        if stamp != None:
+            params = readScanParameters(filePath)
+        newEntries[folder] = {"stamp": stamp, "params": params}
+        changed = True
+    if changed == True or len(newEntries) != len(entries):
+        ## The index is written to a temporary file first, so an interrupted write never leaves a broken index.
+        ## Each call gets its own temporary file, since several loads of the same data folder can run at once
+        ## (e.g. dataLoader() from several threads). The name starts with scanIndexFile so it isn't taken for a folder.
+        tempPath = None
+        try:
+            fileDescriptor, tempPath = tempfile.mkstemp(dir = dataPath, prefix = scanIndexFile + ".", suffix = ".tmp")
+            with os.fdopen(fileDescriptor, "w") as fileOpener:
+                json.dump({"version": scanIndexVersion, "folders": newEntries}, fileOpener, indent = 1)
+            os.replace(tempPath, indexPath)
+        except OSError:
+            if tempPath != None and os.path.exists(tempPath):
+                os.remove(tempPath)
+    return {folder: entry["params"] for folder, entry in newEntries.items()}
+
+## _inRange() is True if value is inside valueRange = (minimum, maximum), or if there is no range
+def _inRange(value, valueRange):
+    return valueRange == None or (valueRange[0] <= value <= valueRange[1])
+
+## selectScans() returns the folders of the index whose Ei, Two Theta and psi are inside eiRange, twothRange and
+## psiRange, each given as (minimum, maximum) with both ends included. A range that is None is not checked.
+## Folders without parameters are never selected.
+def selectScans(index, eiRange = None, twothRange = None, psiRange = None):
+    return [folder for folder, params in index.items() if params != None and _inRange(params["Ei"], eiRange)
+            and _inRange(params["TwoTh"], twothRange) and _inRange(params["psi"], psiRange)]
+
+## scanTable() turns the index into a dataframe with a row (folder, Ei, TwoTh, psi) for each folder
+def scanTable(index):
+    rows = [dict({"folder": folder}, **(params if params != None else {})) for folder, params in index.items()]
+    return pd.DataFrame(rows, columns = ["folder"] + scanParameters)
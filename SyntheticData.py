@@ -0,0 +1,134 @@
+## The SyntheticData module writes simulated-looking data without running McStas, for benchmarks and for trying
+## out the code without the original simulations. It makes the same folder layout that Calibration.py and DataLoader.py read:
+##   pathBase/calibrationFolder/Ei-{ei}/ReuterStokes{row}_{det}_1.psd            (one folder per calibration energy)
+##   pathBase/dataFolder/Ei{ei}_TwoTh{twoth}_psi{psi}/psd_tube1_1a.dat           (the scan parameters)
+##   pathBase/dataFolder/Ei{ei}_TwoTh{twoth}_psi{psi}/ReuterStokes{row}_{det}_{channel}.psd
+## with headers of instrument.startpoint() lines, so any Instrument design can be written:
+##   instrument = Instrument(8, 60, "/tmp/synthetic", "full")
+##   syntheticCalibration(instrument, "calibration")
+##   syntheticData(instrument, "data", psiList = np.arange(0, 90, 2), eventsPerFile = 5000)
+## The neutrons scattered by each analyzer land on its own strip of the detector (between the baffleRegions of
+## the design) and move across the strip with Ef, which is the prismatic effect the calibration is built on.
+## In the data the intensity of each event follows a single dispersion E(Qx, Qy) on top of a flat background.
+
+##Here are the necessary import statements for this file
+import numpy as np
+import os
+import itertools
+from DataLoader import qx_calculator, qy_calculator
+
+## The angles of the tubes relative to the center of their angular channel (the same as in folderEvents() in DataLoader.py)
+tubeAngles = {1: [-3.33, -2.22, -1.11, 0., 1.11, 2.22, 3.33], 2: [-2.775, -1.665, -0.555, 0.555, 1.665, 2.775]}
+
+## defaultDispersion() is the dispersion used by syntheticData() unless another one is given,
+## a band between 0.4 and 1.6 meV that repeats every 2 inverse angstroms
+def defaultDispersion(qx, qy):
+    return 0.4 + 0.6*(np.sin(np.pi*qx/2)**2 + np.sin(np.pi*qy/2)**2)
+
+## stripCenters() gives the center of the strip of each analyzer on the detector, from the lowest
+## to the highest Bragg energy. The strips are the gaps between the baffleRegions of the design.
+def stripCenters(instrument):
+    regions = np.array(instrument.baffleRegions())
+    middles = regions.mean(axis = 1)
+    spacing = np.diff(middles)
+    inner = (middles[:-1] + middles[1:])/2
+    return np.concatenate([[middles[0] - spacing[0]/2], inner, [middles[-1] + spacing[-1]/2]])
+
+## stripPosition() is where a neutron with final energy ef lands on the detector. It goes to the analyzer with the
+## closest Bragg energy and lands further along the strip the higher ef is compared to that Bragg energy
+## (0.25 m per meV, so the -0.08 to 0.12 meV of the calibration spread over 5 cm).
+def stripPosition(instrument, ef):
+    ef = np.atleast_1d(ef)
+    stations = np.array(instrument.stationList())
+    analyzer = np.argmin(np.abs(stations[:, np.newaxis] - ef[np.newaxis, :]), axis = 0)
+    return stripCenters(instrument)[analyzer] + (ef - stations[analyzer])*0.25
+
+## _header() makes a McStas style header of exactly length lines, with the parameters as "# Param: name=value" lines
+def _header(length, component, params, variables):
+    lines = ["# Format: McCode list monitor", "# URL: http://www.mccode.org", "# Creator: SyntheticData.py",
+             "# Instrument: MANTA.instr", "# Ncount: 1000000", "# Trace: no", "# Gravitation: no", "# Seed: 1"]
+    lines += [f"# Param: {name}={value}" for name, value in params.items()]
+    lines += [f"# component: {component}", "# type: array_2d", f"# title: {component}", f"# variables: {variables}"]
+    ## The rest of the header is padded so the events begin at the same line as in the real files
+    while len(lines) < length:
+        lines.append("# ")
+    return "\n".join(lines[:length]) + "\n"
+
+## writePSD() writes a ReuterStokes .psd file with the events in the columns p x y n t
+## (the intensity and the y position, columns 0 and 2, are what readPSD() in PSDReader.py reads).
+def writePSD(filePath, instrument, yPos, intensities, rng):
+    events = np.column_stack([intensities, rng.normal(0, 0.01, len(yPos)), yPos,
+                              np.ones(len(yPos)), rng.uniform(0.001, 0.01, len(yPos))])
+    with open(filePath, "w") as fileOpener:
+        fileOpener.write(_header(instrument.startpoint(), os.path.splitext(os.path.basename(filePath))[0], {},
+                                 "p x y n t"))
+        np.savetxt(fileOpener, events, fmt = "%.6g")
+
+## _tubes() lists the (row, detector, channel) of every tube of the design
+def _tubes(channelNum):
+    for detRow in range(1, 3):
+        for channel in range(1, channelNum + 1):
+            for det in range(len(tubeAngles[detRow])):
+                yield detRow, det, channel
+
+## syntheticCalibration() writes a calibration folder for every energy of instrument.energyList(), where every
+## neutron has Ef = Ei. eventsPerFile is the number of events written to each tube (all 13 tubes of the first
+## channel are written, like the calibration simulations). mosaic spreads the events around their strip position,
+## wider for a larger mosaic of the design.
+def syntheticCalibration(instrument, folder, eventsPerFile = 2000, seed = 0):
+    rng = np.random.default_rng(seed)
+    blur = 0.004*instrument.mosaic/60
+    for ei in instrument.energyList():
+        if instrument.type == "toy model":
+            fileFormat = f"Ei-{ei}TwoTh15psi0"
+        else:
+            fileFormat = f"Ei-{ei}"
+        energyPath = os.path.join(instrument.pathBase, folder, fileFormat)
+        os.makedirs(energyPath, exist_ok = True)
+        for detRow, det, channel in _tubes(1):
+            yPos = stripPosition(instrument, np.full(eventsPerFile, ei)) + rng.normal(0, blur, eventsPerFile)
+            intensities = rng.exponential(1.0, eventsPerFile)
+            ## Some events have zero intensity in the real files as well
+            intensities[rng.random(eventsPerFile) < 0.05] = 0
+            writePSD(os.path.join(energyPath, f"ReuterStokes{detRow}_{det+1}_{channel}.psd"), instrument, yPos, intensities, rng)
+
+## syntheticData() writes a scan point folder for every combination of eiList, twothList and psiList, so the number of
+## folders is len(eiList)*len(twothList)*len(psiList). Each tube (13 for each angular channel, 8 channels for the full
+## instrument) gets eventsPerFile events with final energies spread over the analyzers. The intensity of an event is
+## background plus a Gaussian (of FWHM width) around dispersion(Qx, Qy), any function of Qx and Qy that returns the
+## energy transfer of the excitation. It returns the paths of the folders it wrote.
+def syntheticData(instrument, folder, eiList = (5.0,), twothList = (30.,), psiList = (0., 10., 20.), eventsPerFile = 2000,
+                  dispersion = None, width = 0.1, background = 0.05, seed = 1):
+    if dispersion == None:
+        dispersion = defaultDispersion
+    rng = np.random.default_rng(seed)
+    stations = np.array(instrument.stationList())
+    blur = 0.004*instrument.mosaic/60
+    if instrument.type == "toy model":
+        channelNum = 1
+    else:
+        channelNum = 8
+    folderPaths = []
+    for ei, twothBase, psi in itertools.product(eiList, twothList, psiList):
+        folderPath = os.path.join(instrument.pathBase, folder, f"Ei{ei}_TwoTh{twothBase}_psi{psi}")
+        os.makedirs(folderPath, exist_ok = True)
+        params = {"Ei": ei, "TwoTh": twothBase, "psi": psi}
+        ## psd_tube1_1a.dat only holds the parameters of the scan point for dataLoader()
+        with open(os.path.join(folderPath, "psd_tube1_1a.dat"), "w") as fileOpener:
+            fileOpener.write(_header(30, "psd_tube1_1a", params, "y I I_err N"))
+            fileOpener.write("0 0 0 0\n")
+        ki = 2*np.pi/np.sqrt(81.8047/ei)
+        for detRow, det, channel in _tubes(channelNum):
+            twoth = twothBase - tubeAngles[detRow][det] + (channel - 1)*7.5
+            ## Each event goes to a random analyzer, somewhere in the prismatic range of energies around it
+            ef = rng.choice(stations, eventsPerFile) + rng.uniform(-0.08, 0.12, eventsPerFile)
+            kf = 2*np.pi/np.sqrt(81.8047/ef)
+            energy = dispersion(qx_calculator(ki, kf, twoth, psi), qy_calculator(ki, kf, twoth, psi))
+            sigma = width/2.355
+            weight = background + np.exp(-(ei - ef - energy)**2/(2*sigma**2))
+            intensities = weight*rng.exponential(1.0, eventsPerFile)
+            intensities[rng.random(eventsPerFile) < 0.05] = 0
+            yPos = stripPosition(instrument, ef) + rng.normal(0, blur, eventsPerFile)
+            writePSD(os.path.join(folderPath, f"ReuterStokes{detRow}_{det+1}_{channel}.psd"), instrument, yPos, intensities, rng)
+        folderPaths.append(folderPath)
+    return folderPaths